@@ -0,0 +1,57 @@
+"""
+Times getting a template ready to render in a fresh process: compiling it
+from the .odt file, loading a precompiled artifact, and loading the artifact
+with a Jinja bytecode cache.
+
+    python benchmarks/cold_start.py [--template samples/inputs/simple_template.odt] [--repeat 20]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import tempfile
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from python_odt_template.jinja import environment
+from python_odt_template.jinja import get_odt_renderer
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--template", default="samples/inputs/simple_template.odt")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    renderer = get_odt_renderer(media_path=".")
+    artifact = io.BytesIO()
+    renderer.precompile(args.template, artifact)
+
+    def load():
+        artifact.seek(0)
+        renderer.load_compiled(artifact)
+
+    print(
+        f"compile .odt                    {best_of(args.repeat, lambda: renderer.compile(args.template)) * 1000:8.2f} ms"
+    )
+    print(f"load_compiled                   {best_of(args.repeat, load) * 1000:8.2f} ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = environment.overlay(bytecode_cache=FileSystemBytecodeCache(directory))
+        renderer = get_odt_renderer(media_path=".", env=env)
+        load()
+        print(f"load_compiled + bytecode cache  {best_of(args.repeat, load) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Times each stage of rendering and converting synthetic templates, from
+unpacking the archive to the converted document, and measures the peak
+memory each stage allocates. A stub converter stands in for LibreOffice.
+
+    python benchmarks/pipeline.py [--scenarios fields tables loop images markdown] [--scale 1] [--backend lxml|etree]
+
+Scenarios: `fields` many fields in paragraphs, `tables` tables nested in
+table rows loops, `loop` a long table rows loop, `images` many distinct and
+repeated images, `markdown` large markdown blocks.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import io
+import struct
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Callable
+from typing import Iterator
+
+from python_odt_template import ODTTemplate
+from python_odt_template.images import image_scope
+from python_odt_template.jinja import get_odt_renderer
+from python_odt_template.libreoffice import LOConverter
+from python_odt_template.renderer import parse_rendered_xml
+from python_odt_template.renderer import render_images
+from python_odt_template.xmlbackend import get_backend
+from python_odt_template.xmlbackend import set_default_backend
+
+NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'office:version="1.2"'
+)
+
+STYLES = f"<office:document-styles {NAMESPACES}><office:styles/><office:automatic-styles/></office:document-styles>"
+
+MANIFEST = (
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.text"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>'
+    "</manifest:manifest>"
+)
+
+MARKDOWN = """
+## Section {index}
+
+Some *emphasis*, some **strong** text and a [link](https://example.com/{index}).
+
+- first item
+- second item with `code`
+- third item
+
+1. one
+2. two
+
+```
+preformatted
+block {index}
+```
+"""
+
+
+class StubConverter(LOConverter):
+    """Stands in for LibreOffice: returns a fake PDF after *delay* seconds."""
+
+    raise_on_error = True
+    exec_bin = "true"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def convert(self, input_file, output_dir, to="pdf"):
+        output = Path(output_dir) / f"{Path(input_file).stem}.{to}"
+        output.write_bytes(self.convert_bytes(Path(input_file).read_bytes(), to))
+
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        if self.delay:
+            time.sleep(self.delay)
+        return b"%PDF-1.4\n%" + hashlib.sha256(data).hexdigest().encode() + b"\n%%EOF\n"
+
+
+def field(content: str, description: str = "") -> str:
+    return f'<text:text-input text:description="{description}">{content}</text:text-input>'
+
+
+def paragraph(content: str) -> str:
+    return f"<text:p>{content}</text:p>"
+
+
+def row(*cells: str) -> str:
+    return (
+        "<table:table-row>"
+        + "".join(f"<table:table-cell>{cell}</table:table-cell>" for cell in cells)
+        + "</table:table-row>"
+    )
+
+
+def frame(expression: str) -> str:
+    return (
+        f'<draw:frame draw:name="{expression}" svg:width="2cm" svg:height="2cm">'
+        '<draw:image xlink:href="Pictures/placeholder.png" xlink:type="simple"/></draw:frame>'
+    )
+
+
+def make_template(body: str) -> bytes:
+    """An ODT archive with *body* as its office:text content."""
+    content = (
+        f"<office:document-content {NAMESPACES}><office:body><office:text>{body}</office:text></office:body>"
+        "</office:document-content>"
+    )
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/vnd.oasis.opendocument.text", zipfile.ZIP_STORED)
+        archive.writestr("content.xml", content)
+        archive.writestr("styles.xml", STYLES)
+        archive.writestr("META-INF/manifest.xml", MANIFEST)
+    return output.getvalue()
+
+
+def make_png(path: Path, seed: int, size: int = 64) -> Path:
+    """Write a *size* pixels square PNG whose content depends on *seed*."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixels = b"".join(b"\x00" + bytes((seed * 7 + x + y) % 256 for x in range(size * 3)) for y in range(size))
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(pixels)) + chunk(b"IEND", b"")
+    )
+    return path
+
+
+def fields_scenario(scale: int, media: Path) -> tuple[bytes, dict]:
+    count = 2000 * scale
+    body = "".join(paragraph(f"Field {index}: {field(f'{{{{ values[{index}] }}}}')} tail") for index in range(count))
+    return make_template(body), {"values": [f"value {index}" for index in range(count)]}
+
+
+def tables_scenario(scale: int, media: Path) -> tuple[bytes, dict]:
+    depth = 3
+
+    def table(level: int) -> str:
+        item = f"item{level}"
+        parent = "groups" if level == 0 else f"item{level - 1}.children"
+        inner = table(level + 1) if level + 1 < depth else paragraph(field(f"{{{{ {item}.name }}}}"))
+        return (
+            "<table:table>"
+            + row(paragraph(field(f"{{% for {item} in {parent} %}}", "table-row")))
+            + row(paragraph(field(f"{{{{ {item}.name }}}}")), inner)
+            + row(paragraph(field("{% endfor %}", "table-row")))
+            + "</table:table>"
+        )
+
+    def items(level: int, width: int) -> list[dict]:
+        return [
+            {"name": f"level {level} item {index}", "children": items(level + 1, 4) if level + 1 < depth else []}
+            for index in range(width)
+        ]
+
+    return make_template(table(0)), {"groups": items(0, 25 * scale)}
+
+
+def loop_scenario(scale: int, media: Path) -> tuple[bytes, dict]:
+    cells = [paragraph(field(f"{{{{ row.{name} }}}}")) for name in ("name", "quantity", "price", "total", "note")]
+    body = (
+        "<table:table>"
+        + row(paragraph(field("{% for row in rows %}", "table-row")))
+        + row(*cells)
+        + row(paragraph(field("{% endfor %}", "table-row")))
+        + "</table:table>"
+    )
+    rows = [
+        {"name": f"product {index}", "quantity": index % 7, "price": index * 1.5, "total": index * 3, "note": "ok"}
+        for index in range(5000 * scale)
+    ]
+    return make_template(body), {"rows": rows}
+
+
+def images_scenario(scale: int, media: Path) -> tuple[bytes, dict]:
+    pictures = [make_png(media / f"picture{index}.png", index).name for index in range(50 * scale)]
+    logo = make_png(media / "logo.png", 999).name
+    body = (
+        paragraph(field("{% for picture in pictures %}", "paragraph"))
+        + paragraph(frame("{{ picture|image }}") + frame("{{ logo|image }}"))
+        + paragraph(field("{% endfor %}", "paragraph"))
+    )
+    return make_template(body), {"pictures": pictures, "logo": logo}
+
+
+def markdown_scenario(scale: int, media: Path) -> tuple[bytes, dict]:
+    count = 20 * scale
+    body = "".join(paragraph(field(f"{{{{ blocks[{index}]|odt_markdown }}}}", "text:p")) for index in range(count))
+    blocks = ["".join(MARKDOWN.format(index=index * 10 + part) for part in range(10)) for index in range(count)]
+    return make_template(body), {"blocks": blocks}
+
+
+SCENARIOS: dict[str, Callable[[int, Path], tuple[bytes, dict]]] = {
+    "fields": fields_scenario,
+    "tables": tables_scenario,
+    "loop": loop_scenario,
+    "images": images_scenario,
+    "markdown": markdown_scenario,
+}
+
+
+class Stages:
+    """Records the wall time and, when tracemalloc is tracing, the peak memory of each stage."""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self.peak: dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+        if tracing:
+            self.peak[name] = max(self.peak.get(name, 0), tracemalloc.get_traced_memory()[1] - current)
+
+
+def run_pipeline(renderer, converter: LOConverter, source: bytes, context: dict, stage: Stages) -> bytes:
+    """The stages of `ODTRenderer.render`, then packing and converting the document."""
+    with stage("unpack"):
+        template = ODTTemplate(source)
+    with stage("parse"):
+        content, styles = template.content, template.styles
+    with stage("prepare_tags"):
+        renderer._prepare_tags(content)
+        renderer._prepare_tags(styles)
+    with stage("serialize"):
+        content_xml, styles_xml = content.toxml(), styles.toxml()
+    with stage("unescape"):
+        content_source = renderer._unescape_entities(content_xml)
+        styles_source = renderer._unescape_entities(styles_xml)
+    with stage("compile"):
+        render_content = renderer.compile_source(content_source)
+        render_styles = renderer.compile_source(styles_source)
+
+    with image_scope():
+        with stage("render"):
+            rendered_content, rendered_styles = render_content(context), render_styles(context)
+        with stage("reparse"):
+            content_document = parse_rendered_xml(rendered_content)
+            styles_document = parse_rendered_xml(rendered_styles)
+        with stage("render_images"):
+            render_images(content_document, image_writer=template.add_image)
+
+    with stage("pack"):
+        template.content.replace(template.content.find("office:body"), content_document.find("office:body"))
+        template.styles = styles_document
+        document = template.pack_bytes()
+    with stage("convert"):
+        return converter.convert_bytes(document, "pdf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--convert-delay", type=float, default=0.0, help="seconds the stub converter takes")
+    args = parser.parse_args()
+
+    if args.backend:
+        set_default_backend(args.backend)
+    converter = StubConverter(args.convert_delay)
+    print(f"backend: {get_backend().name}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        media = Path(directory)
+        renderer = get_odt_renderer(media_path=media)
+        for name in args.scenarios:
+            source, context = SCENARIOS[name](args.scale, media)
+
+            # Best wall time of each stage over the runs, then one traced run for memory
+            best: dict[str, float] = {}
+            for _ in range(args.repeat):
+                timings = Stages()
+                run_pipeline(renderer, converter, source, context, timings)
+                for stage_name, seconds in timings.seconds.items():
+                    best[stage_name] = min(best.get(stage_name, seconds), seconds)
+            memory = Stages()
+            tracemalloc.start()
+            try:
+                run_pipeline(renderer, converter, source, context, memory)
+            finally:
+                tracemalloc.stop()
+
+            print(f"\n{name} (template {len(source) / 1024:.0f} KiB)")
+            print(f"{'stage':<14} {'ms':>10} {'peak KiB':>10}")
+            for stage_name, seconds in best.items():
+                print(f"{stage_name:<14} {seconds * 1000:>10.2f} {memory.peak[stage_name] / 1024:>10.0f}")
+            print(f"{'total':<14} {sum(best.values()) * 1000:>10.2f} {max(memory.peak.values()) / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Times ODTRenderer tag preparation on synthetic documents with a growing
+number of input fields, the time per field should stay flat.
+
+    python benchmarks/prepare_tags.py [--backend lxml|etree] [--fields 1000 2000 4000 8000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from python_odt_template.jinja import get_odt_renderer
+from python_odt_template.xmlbackend import get_backend
+from python_odt_template.xmlbackend import parse_xml
+
+NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+)
+
+
+def field(content: str, description: str = "") -> str:
+    return f'<text:text-input text:description="{description}">{content}</text:text-input>'
+
+
+def make_document(fields: int) -> str:
+    """
+    A document with *fields* input fields: a long run of paragraphs, some
+    wrapped in paragraph scoped conditions, then a table with a row loop.
+    """
+    paragraphs = []
+    rows = []
+    for index in range(fields // 2):
+        if index % 10 == 0:
+            paragraphs.append(f"<text:p>{field('{% if show %}', 'paragraph')}</text:p>")
+        paragraphs.append(f"<text:p>Item {index}: {field('{{ item.name }}')} tail</text:p>")
+        if index % 10 == 0:
+            paragraphs.append(f"<text:p>{field('{% endif %}', 'paragraph')}</text:p>")
+        rows.append(
+            "<table:table-row>"
+            f"<table:table-cell><text:p>{field('{{ row.name }}')}</text:p></table:table-cell>"
+            "</table:table-row>"
+        )
+    loop_start = f"<table:table-row><table:table-cell><text:p>{field('{% for row in rows %}')}</text:p></table:table-cell></table:table-row>"
+    loop_end = f"<table:table-row><table:table-cell><text:p>{field('{% endfor %}')}</text:p></table:table-cell></table:table-row>"
+    return (
+        f"<office:document-content {NAMESPACES}><office:body><office:text>"
+        + "".join(paragraphs)
+        + f"<table:table>{loop_start}{''.join(rows)}{loop_end}</table:table>"
+        + "</office:text></office:body></office:document-content>"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--fields", type=int, nargs="+", default=[1000, 2000, 4000, 8000, 16000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend)
+    renderer = get_odt_renderer(media_path=".")
+    print(f"backend: {backend.name}")
+    print(f"{'fields':>8} {'seconds':>10} {'us/field':>10}")
+    for fields in args.fields:
+        source = make_document(fields)
+        best = float("inf")
+        for _ in range(args.repeat):
+            document = parse_xml(source, backend)
+            start = time.perf_counter()
+            renderer._prepare_tags(document)
+            best = min(best, time.perf_counter() - start)
+        print(f"{fields:>8} {best:>10.4f} {best / fields * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
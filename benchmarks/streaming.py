@@ -0,0 +1,63 @@
+"""
+Compares the wall time and peak memory of writing a compiled template whose
+content is parsed back, spliced, or streamed into the archive, on the long
+table rows loop of the pipeline benchmark.
+
+    python benchmarks/streaming.py [--rows 50000] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from pipeline import loop_scenario
+from python_odt_template.jinja import get_odt_renderer
+
+MODES = {
+    "parse": {},
+    "splice": {"splice_xml": True},
+    "stream": {"stream_xml": True},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        media = Path(directory)
+        source, context = loop_scenario(1, media)
+        context["rows"] = [context["rows"][index % len(context["rows"])] for index in range(args.rows)]
+        target = media / "output.odt"
+
+        print(f"{args.rows} rows")
+        print(f"{'mode':<8} {'ms':>10} {'peak KiB':>10} {'output KiB':>10}")
+        for mode, options in MODES.items():
+            renderer = get_odt_renderer(media_path=media)
+            for name, value in options.items():
+                setattr(renderer, name, value)
+            compiled = renderer.compile(source)
+
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                compiled.write(context, target)
+                best = min(best, time.perf_counter() - start)
+
+            tracemalloc.start()
+            try:
+                compiled.write(context, target)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print(f"{mode:<8} {best * 1000:>10.1f} {peak / 1024:>10.0f} {target.stat().st_size / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Times ODTRenderer._unescape_entities against the original implementation,
+which rescanned the whole document once per entity until nothing changed, on
+a large document. tests/test_unescape_entities.py checks both agree.
+
+    python benchmarks/unescape_entities.py [--fields 20000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from urllib.parse import unquote
+
+from python_odt_template.jinja import get_odt_renderer
+
+
+def legacy_unescape_entities(renderer, xml_text: str) -> str:
+    for regexp, replacement in renderer.escape_map.items():
+        while True:
+            xml_text, substitutions = regexp.subn(replacement, xml_text)
+            if not substitutions:
+                break
+
+    robj = re.compile(r"(?is)(xlink:href=\")secretary:(.*?)(\")")
+
+    def replacement(match):
+        url = renderer.variable_pattern.sub(r"\1 SafeValue(\2) \3", unquote(match.group(2)))
+        return match.group(1) + url + match.group(3)
+
+    while True:
+        xml_text, rep = robj.subn(replacement, xml_text)
+        if not rep:
+            break
+
+    return xml_text
+
+
+def make_document(fields: int) -> str:
+    paragraphs = []
+    for index in range(fields):
+        paragraphs.append(
+            f"<text:p>Row {index} &amp; more</text:p><text:p><text:span>{{{{ row.a }}}}</text:span></text:p>"
+        )
+        if index % 10 == 0:
+            paragraphs.append("{% if row.a &gt; 1 and row.b == &quot;x&quot; %}<text:p>big</text:p>{% endif %}")
+    return "<office:text>" + "".join(paragraphs) + "</office:text>"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fields", type=int, default=20000)
+    args = parser.parse_args()
+
+    renderer = get_odt_renderer(media_path=".")
+    document = make_document(args.fields)
+    for name, unescape in (
+        ("legacy", lambda text: legacy_unescape_entities(renderer, text)),
+        ("current", renderer._unescape_entities),
+    ):
+        start = time.perf_counter()
+        unescape(document)
+        print(f"{name:>8}: {time.perf_counter() - start:.4f}s for {len(document) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,30 @@
 # SPDX-License-Identifier: MIT
 from __future__ import annotations
 
+from .cache import CachingConverter
+from .cache import TemplateCache
 from .libreoffice import LibreOffice
 from .libreoffice import libreoffice
 from .libreoffice import LibreOfficeError
+from .libreoffice import LibreOfficePool
 from .libreoffice import LOConverter
+from .libreoffice import UnoClientConverter
 from .libreoffice import UnoConvert
 from .libreoffice import unoconvert
+from .renderer import InvalidXMLError
 from .template import ODTTemplate
 
-__all__ = ("ODTTemplate", "LibreOffice", "UnoConvert", "LOConverter", "LibreOfficeError", "unoconvert", "libreoffice")
+__all__ = (
+    "ODTTemplate",
+    "TemplateCache",
+    "CachingConverter",
+    "LibreOffice",
+    "UnoConvert",
+    "UnoClientConverter",
+    "LOConverter",
+    "LibreOfficeError",
+    "LibreOfficePool",
+    "InvalidXMLError",
+    "unoconvert",
+    "libreoffice",
+)
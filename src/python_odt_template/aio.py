@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+import weakref
+from concurrent.futures import Executor
+from functools import partial
+from typing import Any
+from typing import Callable
+
+
+class AsyncLimitMixin:
+    """Limits how many calls to the async methods of an object run at once."""
+
+    # Maximum number of concurrent async calls, set it on the instance to change it
+    max_concurrency: int = 4
+
+    @property
+    def async_limiter(self) -> asyncio.Semaphore:
+        """The limiter of the running event loop, a semaphore is bound to the first loop that waits on it."""
+        limiters = self.__dict__.get("_async_limiters")
+        if limiters is None:
+            limiters = self.__dict__["_async_limiters"] = weakref.WeakKeyDictionary()
+        loop = asyncio.get_running_loop()
+        limiter = limiters.get(loop)
+        if limiter is None:
+            limiter = limiters[loop] = asyncio.Semaphore(self.max_concurrency)
+        return limiter
+
+    async def run_limited(
+        self, func: Callable[..., Any], *args, timeout: float | None = None, executor: Executor | None = None, **kwargs
+    ) -> Any:
+        """
+        Run *func* in *executor*, the event loop's default executor if None,
+        once a slot of `async_limiter` is free. A timeout or cancellation stops
+        waiting, not the call: it runs to completion in its thread and keeps
+        its slot until then, so that at most `max_concurrency` calls run.
+        """
+        limiter = self.async_limiter
+        await limiter.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+        except BaseException:
+            limiter.release()
+            raise
+        future.add_done_callback(partial(_release, limiter))
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+
+def _release(limiter: asyncio.Semaphore, future: asyncio.Future) -> None:
+    limiter.release()
+    if not future.cancelled():
+        # Retrieved, a call nobody waits for anymore may have failed
+        future.exception()
+
+
+async def run_blocking(func: Callable[..., Any], *args, executor: Executor | None = None, **kwargs) -> Any:
+    """
+    Run *func* in *executor*, the event loop's default executor if None. A
+    cancelled or timed out call stops waiting, but the call itself runs to
+    completion in its thread.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import itertools
+import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+
+from python_odt_template.renderer import CompiledODTTemplate
+from python_odt_template.renderer import ODTRenderer
+from python_odt_template.renderer import PreparedODTTemplate
+
+__all__ = ("RenderResult", "render_many")
+
+
+@dataclass
+class RenderResult:
+    """
+    Outcome of rendering the context at *index*. *output* is the written file
+    path when rendering to a directory, the document bytes otherwise.
+    """
+
+    index: int
+    output: Path | bytes | None = None
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def render_many(
+    template: str | Path | bytes | IO[bytes],
+    contexts: Iterable[dict],
+    output: str | Path | Callable[[int, bytes], None] | None,
+    renderer_factory: Callable[[], ODTRenderer],
+    workers: int | None = None,
+    filename: str = "{index}.odt",
+) -> Iterator[RenderResult]:
+    """
+    Render *template* once per context in *contexts*, in parallel across
+    *workers* processes (defaults to the number of CPUs).
+
+    The template is prepared once and shipped to the workers, each worker
+    compiles it a single time. *renderer_factory* must be picklable, e.g. a
+    module level function or a `functools.partial` of `get_odt_renderer`.
+
+    *output* is either a directory, in which case documents are written there
+    by the workers under *filename* (formatted with the context index), a sink
+    called with the index and bytes of each document, or None to get the bytes
+    back on the results.
+
+    Results are yielded as they complete, a failing context does not stop the
+    others: its result carries the raised exception instead.
+    """
+    output_dir = None if output is None or callable(output) else Path(output)
+    sink = output if callable(output) else None
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    prepared = renderer_factory().prepare(template)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = _render_serially(renderer_factory, prepared, contexts, output_dir, filename)
+    else:
+        results = _render_in_pool(renderer_factory, prepared, contexts, output_dir, filename, workers)
+
+    for result in results:
+        if sink is not None and result.ok:
+            sink(result.index, result.output)
+        yield result
+
+
+def _render_serially(
+    renderer_factory: Callable[[], ODTRenderer],
+    prepared: PreparedODTTemplate,
+    contexts: Iterable[dict],
+    output_dir: Path | None,
+    filename: str,
+) -> Iterator[RenderResult]:
+    with renderer_factory().compile(prepared) as compiled:
+        for index, context in enumerate(contexts):
+            yield _render(compiled, index, context, output_dir, filename)
+
+
+def _render_in_pool(
+    renderer_factory: Callable[[], ODTRenderer],
+    prepared: PreparedODTTemplate,
+    contexts: Iterable[dict],
+    output_dir: Path | None,
+    filename: str,
+    workers: int,
+) -> Iterator[RenderResult]:
+    indexed_contexts = enumerate(contexts)
+    pending = {}
+
+    def new_executor() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(renderer_factory, prepared))
+
+    executor = new_executor()
+
+    def submit(count: int):
+        nonlocal executor
+        # Only keep a few contexts in flight, contexts may be a lazy iterable
+        for index, context in itertools.islice(indexed_contexts, count):
+            args = (_render_in_worker, index, context, output_dir, filename)
+            try:
+                pending[executor.submit(*args)] = index
+            except BrokenProcessPool:
+                # A worker died since the last results, this context did not run
+                executor.shutdown(wait=False)
+                executor = new_executor()
+                pending[executor.submit(*args)] = index
+
+    try:
+        submit(workers * 2)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:  # noqa: BLE001
+                    # The context or result could not be pickled, or a worker
+                    # died (e.g. killed for lack of memory) failing every
+                    # context in flight, the next submit replaces the pool
+                    yield RenderResult(index, error=e)
+            submit(len(done))
+    finally:
+        # The consumer may stop early, contexts not started yet are dropped
+        executor.shutdown(cancel_futures=True)
+
+
+_compiled: CompiledODTTemplate | None = None
+
+
+def _init_worker(renderer_factory: Callable[[], ODTRenderer], prepared: PreparedODTTemplate) -> None:
+    global _compiled
+    _compiled = renderer_factory().compile(prepared)
+
+
+def _render_in_worker(index: int, context: dict, output_dir: Path | None, filename: str) -> RenderResult:
+    return _render(_compiled, index, context, output_dir, filename)
+
+
+def _render(
+    compiled: CompiledODTTemplate, index: int, context: dict, output_dir: Path | None, filename: str
+) -> RenderResult:
+    try:
+        if output_dir is None:
+            return RenderResult(index, compiled.render(context))
+
+        path = output_dir / filename.format(index=index)
+        compiled.write(context, path)
+        return RenderResult(index, path)
+    except Exception as e:  # noqa: BLE001
+        # A failing context is reported on its result, the others go on
+        return RenderResult(index, error=e)
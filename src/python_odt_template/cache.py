@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from dataclasses import field
+from functools import cached_property
+from pathlib import Path
+from typing import IO
+from typing import Protocol
+from typing import TYPE_CHECKING
+
+from python_odt_template.libreoffice import InMemoryConverterMixin
+from python_odt_template.libreoffice import LOConverter
+
+if TYPE_CHECKING:
+    from python_odt_template.renderer import CompiledODTTemplate
+    from python_odt_template.renderer import ODTRenderer
+
+__all__ = (
+    "CacheStats",
+    "CachingConverter",
+    "ConversionStore",
+    "DirectoryStore",
+    "MemoryStore",
+    "TemplateCache",
+    "document_digest",
+)
+
+logger = logging.getLogger("python_odt_template")
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    entries: int
+    size: int
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class _Entry:
+    compiled: CompiledODTTemplate
+    mtime_ns: int
+    file_size: int
+    digest: str
+    size: int
+
+
+class TemplateCache:
+    """
+    Keeps templates compiled by *renderer* in memory, keyed by their file path.
+
+    Each lookup stats the file: a template whose modification time or size
+    changed is read again, and compiled again unless its content hash is the
+    same. The least recently used templates are evicted once there are more
+    than *max_entries* of them or they take more than *max_size* bytes, as
+    measured by the archive and prepared sources sizes. Compiled templates do
+    not keep their parsed XML parts, these sizes are what they hold.
+
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, renderer: ODTRenderer, max_entries: int = 64, max_size: int = 256 * 1024 * 1024):
+        self.renderer = renderer
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._hits = self._misses = self._evictions = self._invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path: str | Path) -> bool:
+        return os.path.abspath(path) in self._entries
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self._hits, self._misses, self._evictions, self._invalidations, len(self._entries), self._size
+            )
+
+    def get(self, path: str | Path) -> CompiledODTTemplate:
+        """Returns the compiled template at *path*, compiling it when it is not cached or changed."""
+        key = os.path.abspath(path)
+        compiled = self._lookup(key)
+        if compiled is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+            # Threads missing the same template wait for the one compiling it
+            with key_lock:
+                compiled = self._lookup(key) or self._compile(key)
+        return compiled
+
+    def _lookup(self, key: str) -> CompiledODTTemplate | None:
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.mtime_ns, entry.file_size) == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry.compiled
+        return None
+
+    def _compile(self, key: str) -> CompiledODTTemplate:
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._entries.get(key)
+
+        source = Path(key).read_bytes()
+        digest = hashlib.sha256(source).hexdigest()
+
+        with self._lock:
+            if entry is not None and entry.digest == digest:
+                # Touched but not modified
+                entry.mtime_ns, entry.file_size = stat.st_mtime_ns, stat.st_size
+                self._hits += 1
+                return entry.compiled
+            self._misses += 1
+
+        compiled = self.renderer.compile(source)
+        prepared = compiled.prepared
+        size = len(source) + len(prepared.content) + len(prepared.styles) + len(prepared.manifest)
+        new_entry = _Entry(compiled, stat.st_mtime_ns, stat.st_size, digest, size)
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+                if previous.digest != digest:
+                    self._invalidations += 1
+            self._entries[key] = new_entry
+            self._size += size
+            self._evict()
+        return compiled
+
+    def render(self, path: str | Path, context: dict) -> bytes:
+        """Render the template at *path* with *context* and returns the document bytes."""
+        return self.get(path).render(context)
+
+    def write(self, path: str | Path, context: dict, target: str | Path | IO[bytes]) -> None:
+        """Render the template at *path* with *context* to a file path or a writable stream."""
+        self.get(path).write(context, target)
+
+    def invalidate(self, path: str | Path | None = None) -> None:
+        """Drop the template at *path* from the cache, or every template."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._key_locks.clear()
+                self._size = 0
+                return
+            key = os.path.abspath(path)
+            entry = self._entries.pop(key, None)
+            self._key_locks.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def _evict(self) -> None:
+        # The most recent entry is kept even when it is bigger than max_size
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._size > self.max_size):
+            key, entry = self._entries.popitem(last=False)
+            self._key_locks.pop(key, None)
+            self._size -= entry.size
+            self._evictions += 1
+
+
+class ConversionStore(Protocol):
+    """Where `CachingConverter` keeps converted documents, by key."""
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, data: bytes) -> None: ...
+
+
+class MemoryStore:
+    """Keeps up to *max_entries* converted documents and *max_size* bytes in memory, least recently used first out."""
+
+    def __init__(self, max_entries: int = 256, max_size: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def set(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = data
+            self.size += len(data)
+            while len(self._entries) > self.max_entries or self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+
+_CHECKSUM_SIZE = hashlib.sha256().digest_size
+
+
+class DirectoryStore:
+    """
+    Keeps converted documents as files in *directory*, up to *max_size* bytes.
+    The least recently used files, by modification time, are removed first.
+    Several processes can share the directory.
+    """
+
+    def __init__(self, directory: str | Path, max_size: int = 1024 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Size of each file by name, rescanned on eviction to account for other processes
+        self._sizes = {path.name: path.stat().st_size for path in self.directory.glob("*.bin")}
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    def get(self, key: str) -> bytes | None:
+        path = self.directory / f"{key}.bin"
+        try:
+            stored = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        # Files end with the digest of the document, which catches truncated or corrupted files
+        data, checksum = stored[:-_CHECKSUM_SIZE], stored[-_CHECKSUM_SIZE:]
+        if len(stored) < _CHECKSUM_SIZE or hashlib.sha256(data).digest() != checksum:
+            logger.warning("Corrupted conversion removed from the cache: %s", path)
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self._sizes.pop(path.name, None)
+            return None
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        if len(data) + _CHECKSUM_SIZE > self.max_size:
+            return
+        # Written under another name and renamed, readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+            file.write(data)
+            file.write(hashlib.sha256(data).digest())
+        os.replace(file.name, self.directory / f"{key}.bin")
+
+        with self._lock:
+            self._sizes[f"{key}.bin"] = len(data) + _CHECKSUM_SIZE
+            if sum(self._sizes.values()) > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.directory.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, path, stat.st_size))
+        entries.sort()
+
+        self._sizes = {path.name: size for _, path, size in entries}
+        size = sum(self._sizes.values())
+        for _, path, file_size in entries:
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            del self._sizes[path.name]
+            size -= file_size
+            self.evictions += 1
+
+
+def document_digest(data: bytes) -> str:
+    """
+    Hash of the members of the document archive *data*. Unlike a hash of the
+    archive, it does not depend on the members timestamps or compression.
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            content = archive.read(info)
+            digest.update(f"{info.filename}\0{len(content)}\0".encode())
+            digest.update(content)
+    return digest.hexdigest()
+
+
+@dataclass
+class CachingConverter(InMemoryConverterMixin, LOConverter):
+    """
+    Wraps *converter* to reuse the conversions of identical documents. Results
+    are kept in *store* (in memory by default) by document content, target
+    format and filter, along with *options*: a string standing for whatever
+    else changes the converter output, e.g. its version or configuration.
+    """
+
+    converter: LOConverter
+    store: ConversionStore = field(default_factory=MemoryStore)
+    options: str = ""
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    @property
+    def raise_on_error(self) -> bool:
+        return self.converter.raise_on_error
+
+    @cached_property
+    def exec_bin(self) -> str:
+        return self.converter.exec_bin
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            self.hits,
+            self.misses,
+            getattr(self.store, "evictions", 0),
+            0,
+            len(self.store) if hasattr(self.store, "__len__") else 0,
+            getattr(self.store, "size", 0),
+        )
+
+    def cache_key(self, data: bytes, to: str, filtername: str | None = None) -> str:
+        parts = f"{document_digest(data)}\0{to}\0{filtername or ''}\0{self.options}"
+        return hashlib.sha256(parts.encode()).hexdigest()
+
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        """Convert the document *data* to the *to* format, or returns the result of a previous conversion."""
+        try:
+            key = self.cache_key(data, to, filtername)
+        except zipfile.BadZipFile:
+            # Not an OpenDocument archive, e.g. a flat XML document
+            key = hashlib.sha256(data + f"\0{to}\0{filtername or ''}\0{self.options}".encode()).hexdigest()
+
+        converted = self.store.get(key)
+        if converted is not None:
+            self.hits += 1
+            return converted
+
+        self.misses += 1
+        converted = self.converter.convert_bytes(data, to, filtername)
+        try:
+            self.store.set(key, converted)
+        except OSError as e:
+            # A cache that cannot be written must not fail the conversion
+            logger.warning("Conversion not cached: %s", e)
+        return converted
@@ -1,3 +1,11 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable
+
+from python_odt_template.cache import TemplateCache
+from python_odt_template.images import ImageLoader
 from python_odt_template.renderer import ODTRenderer
 
 from .filters import odt_markdown
@@ -7,18 +15,32 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.template import Context
 from django.template import Template
+from django.utils.module_loading import import_string
 
 register = template.Library()
 
 
 @register.filter
 def image(value):
+    return _get_image_loader()(value)
+
+
+@lru_cache(maxsize=None)
+def _get_image_loader() -> ImageLoader:
+    """
+    The loader is configured by the optional ODT_TEMPLATE_IMAGES setting, a
+    dict of `ImageLoader` arguments where "resolver" may be a dotted path.
+    """
     try:
         static_path = settings.STATICFILES_DIRS[0]
     except IndexError as e:
         msg = "You must add a least one directory to STATICFILES_DIRS in your settings.py file"
         raise ImproperlyConfigured(msg) from e
-    return static_path / value
+
+    options = dict(getattr(settings, "ODT_TEMPLATE_IMAGES", {}))
+    if isinstance(options.get("resolver"), str):
+        options["resolver"] = import_string(options["resolver"])
+    return ImageLoader(static_path, **options)
 
 
 register.filter("odt_markdown", odt_markdown)
@@ -29,6 +51,11 @@ def _render(template_str: str, context: dict) -> str:
     return Template(template_str).render(Context(context))
 
 
+def _compile(template_str: str) -> Callable[[dict], str]:
+    template = Template(template_str)
+    return lambda context: template.render(Context(context))
+
+
 def get_odt_renderer() -> ODTRenderer:
     return ODTRenderer(
         block_start_string="{%",
@@ -36,4 +63,19 @@ def get_odt_renderer() -> ODTRenderer:
         variable_start_string="{{",
         variable_end_string="}}",
         render_func=_render,
+        compile_func=_compile,
     )
+
+
+@lru_cache(maxsize=None)
+def get_template_cache() -> TemplateCache:
+    """
+    The process wide cache of compiled templates, configured by the optional
+    ODT_TEMPLATE_CACHE setting, a dict of `TemplateCache` arguments.
+    """
+    return TemplateCache(get_odt_renderer(), **getattr(settings, "ODT_TEMPLATE_CACHE", {}))
+
+
+def render_odt(template_path: str | Path, context: dict) -> bytes:
+    """Render the template at *template_path* through the template cache and returns the document bytes."""
+    return get_template_cache().render(template_path, context)
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
+import hashlib
 import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from html import unescape
 
-from typing import TYPE_CHECKING
-from defusedxml.minidom import parseString
 from markupsafe import Markup
 from python_odt_template.markdown_map import transform_map
+from python_odt_template.xmlbackend import escape_attribute
+from python_odt_template.xmlbackend import escape_text
 
-if TYPE_CHECKING:
-    from xml.dom.minidom import Node, Document
+_local = threading.local()
 
 
 def pad_string(value, length=5):
@@ -18,85 +22,224 @@ def pad_string(value, length=5):
 
 def odt_markdown(value: str) -> str:
     """
-    Converts markdown value into an ODT formatted text.
+    Converts markdown value into an ODT formatted text. The conversions of
+    the last 512 distinct values are remembered, e.g. the same snippet
+    rendered on each row of a loop is converted once.
     """
-    from markdown2 import markdown
+    return Markup(_cached_markdown_to_odt(str(value)))
 
-    html = markdown(value)
-    html_object = parseString("<html>{}</html>".format(html.encode("ascii", "xmlcharrefreplace")))
 
-    # Transform every known HTML tags to odt
+def markdown_to_odt(value: str) -> str:
+    """
+    Converts markdown to ODT XML: markdown2 renders it to HTML, which is
+    translated in a single pass following `transform_map`.
+    """
+    html = _markdown_converter().convert(value)
+
+    # Tags with an id are numbered tag after tag, in transform_map order
+    id_offsets = {}
+    count = 0
     for tagname, transform in transform_map.items():
-        html_tags = html_object.getElementsByTagName(tagname)
-        for tag in html_tags:
-            _html_tag_to_odt(html_object, tag, transform)
+        if "id_prefix" in transform:
+            id_offsets[tagname] = count
+            count += len(re.findall(rf"<{tagname}[\s/>]", html, re.IGNORECASE))
+
+    translator = _HTMLToODT(value, id_offsets)
+    translator.feed(html)
+    translator.close()
+    return "".join(translator.chunks)
+
+
+def _markdown_converter():
+    # A converter is reset on each conversion, but not safe to share between threads
+    converter = getattr(_local, "markdown", None)
+    if converter is None:
+        from markdown2 import Markdown
+
+        converter = _local.markdown = Markdown()
+    return converter
+
 
-    def _node_to_str(node):
-        result = node.toxml()
+_cached_markdown_to_odt = lru_cache(maxsize=512)(markdown_to_odt)
 
-        # Convert single linebreaks in preformatted nodes to text:line-break
-        if node.__class__.__name__ != "Text" and node.getAttribute("text:style-name") == "Preformatted_20_Text":
-            result = result.replace("\n", "<text:line-break/>")
 
-        # All double linebreaks should be converted to an empty paragraph
-        return result.replace("\n\n", '<text:p text:style-name="Standard"/>')
+def _stable_id(prefix: str, source: str, index: int) -> str:
+    """An 18 digits id, like the ones LibreOffice generates, derived from *source* and *index*."""
+    digest = hashlib.sha256(f"{index}\0{source}".encode()).digest()
+    return prefix + str(100000000000000000 + int.from_bytes(digest[:8], "big") % 800000000000000000)
 
-    str_nodes = (_node_to_str(node) for node in html_object.getElementsByTagName("html")[0].childNodes)
-    return Markup("".join(str_nodes))
 
+# HTML elements without an end tag
+_VOID_ELEMENTS = frozenset(("area", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"))
 
-def _html_tag_to_odt(html: Document, tag: Node, transform: dict):
+
+@dataclass
+class _OpenElement:
+    html_tag: str
+    odt_tag: str
+    preformatted: bool
+    has_content: bool = False
+    # Whether the content of a list item is wrapped in a paragraph, decided on its first content
+    wrap: bool | None = None
+
+
+# A start or end tag, a comment or declaration to skip, or text
+_HTML_TOKEN_PATTERN = re.compile(
+    r"""<(/?)([a-zA-Z][^\s/>]*)((?:\s+[^\s=/>]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]+))?)*)\s*(/?)>"""
+    r"|<!--.*?-->|<[!?][^>]*>|([^<]+|<)",
+    re.DOTALL,
+)
+_HTML_ATTRIBUTE_PATTERN = re.compile(r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+
+
+class _HTMLToODT:
     """
-    Replace tag in html with a new odt tag created from the instructions
-    in transform dictionary.
+    Writes the ODT XML of the HTML rendered from the markdown *source* as it
+    is tokenized. Elements are renamed and given attributes as
+    `transform_map` says, elements it does not know are copied.
     """
-    odt_tag = html.createElement(transform["replace_with"])
-
-    # First lets work with the content
-    if tag.hasChildNodes():
-        # Only when there's a double linebreak separating list elements,
-        # markdown2 wraps the content of the element inside a <p> element.
-        # In ODT we should always encapsulate list content in a single paragraph.
-        # Here we create the container paragraph in case markdown didn't.
-        if tag.localName == "li" and tag.childNodes[0].localName != "p":
-            container = html.createElement("text:p")
-            odt_tag.appendChild(container)
-        elif tag.localName == "code":
-
-            def traverse_preformatted(node):
-                if node.hasChildNodes():
-                    for n in node.childNodes:
-                        traverse_preformatted(n)
-                else:
-                    container = html.createElement("text:span")
-                    for text in re.split("(\n)", node.nodeValue.lstrip("\n")):
-                        if text == "\n":
-                            container.appendChild(html.createElement("text:line-break"))
-                        else:
-                            container.appendChild(html.createTextNode(text))
-
-                    node.parentNode.replaceChild(container, node)
-
-            traverse_preformatted(tag)
-            container = odt_tag
-        else:
-            container = odt_tag
 
-        # Insert html tag content (actually a group of child nodes)
-        for child in tag.childNodes:
-            container.appendChild(child.cloneNode(True))
+    def __init__(self, source: str, id_offsets: dict[str, int]):
+        self.source = source
+        self.id_counters = dict(id_offsets)
+        self.chunks: list[str] = []
+        self._element_chunks: list[str] = []
+        self._open: list[_OpenElement] = []
+        self._text: list[str] = []
+        self._code_depth = 0
+        self._static_start_tags: dict[str, tuple[str, str, bool]] = {}
+        self._write = self._element_chunks.append
+
+    def feed(self, html: str) -> None:
+        for match in _HTML_TOKEN_PATTERN.finditer(html):
+            end_tag, tag, attributes, self_closing, text = match.groups()
+            if text is not None:
+                self._text.append(unescape(text) if "&" in text else text)
+            elif tag is None:
+                # Comments and declarations
+                continue
+            elif end_tag:
+                self._end_tag(tag.lower())
+            else:
+                tag = tag.lower()
+                self._start(tag, _html_attributes(attributes) if attributes else {})
+                if self_closing or tag in _VOID_ELEMENTS:
+                    self._end(len(self._open) - 1)
+
+    def close(self) -> None:
+        if self._open:
+            self._end(0)
+        self._flush_text()
+
+    def _end_tag(self, tag: str) -> None:
+        for position in range(len(self._open) - 1, -1, -1):
+            if self._open[position].html_tag == tag:
+                self._end(position)
+                return
+
+    def _start(self, tag: str, attrs: dict[str, str]) -> None:
+        self._flush_text()
+        start = self._static_start_tags.get(tag)
+        if start is None:
+            start = self._start_tag(tag, attrs)
+        odt_tag, start_tag, preformatted = start
+
+        self._add_content(odt_tag)
+        self._write(start_tag)
+        self._open.append(_OpenElement(tag, odt_tag, preformatted))
+        if tag == "code":
+            self._code_depth += 1
+
+    def _start_tag(self, tag: str, attrs: dict[str, str]) -> tuple[str, str, bool]:
+        """Returns the ODT name of the element *tag*, its start tag without the closing ">" and whether it is preformatted."""
+        transform = transform_map.get(tag)
+        if transform is None:
+            odt_tag = tag
+            attributes = attrs
+        else:
+            odt_tag = transform["replace_with"]
+            attributes = {f"text:{style}": value for style, value in transform.get("style_attributes", {}).items()}
+            if "attributes" in transform:
+                attributes.update(transform["attributes"])
+                # Special handling of <a> tags and their href attribute
+                href = attrs.get("href")
+                if tag == "a" and href is not None:
+                    attributes["xlink:href"] = href
+            if "id_prefix" in transform:
+                index = self.id_counters[tag] = self.id_counters.get(tag, 0) + 1
+                attributes["xml:id"] = _stable_id(transform["id_prefix"], self.source, index - 1)
+
+        start_tag = f"<{odt_tag}" + "".join(
+            f' {name}="{escape_attribute(value)}"' for name, value in attributes.items()
+        )
+        start = (odt_tag, start_tag, attributes.get("text:style-name") == "Preformatted_20_Text")
+        if transform is not None and "attributes" not in transform and "id_prefix" not in transform:
+            # Same start tag for every element with that name
+            self._static_start_tags[tag] = start
+        return start
+
+    def _end(self, position: int) -> None:
+        """Close the open elements from the last one to the one at *position*."""
+        self._flush_text()
+        while len(self._open) > position:
+            element = self._open.pop()
+            if element.wrap:
+                self._write("</text:p>")
+            self._write(f"</{element.odt_tag}>" if element.has_content else "/>")
+            if element.html_tag == "code":
+                self._code_depth -= 1
+
+            if not self._open:
+                result = "".join(self._element_chunks)
+                self._element_chunks.clear()
+                # Convert single linebreaks in preformatted nodes to text:line-break
+                if element.preformatted:
+                    result = result.replace("\n", "<text:line-break/>")
+                self.chunks.append(_text_to_str(result))
+
+    def _add_content(self, odt_tag: str | None) -> None:
+        """Mark the open element as having content, a child element named *odt_tag* or text when None."""
+        if not self._open:
+            return
+        parent = self._open[-1]
+        if not parent.has_content:
+            parent.has_content = True
+            self._write(">")
+        if parent.html_tag == "li" and parent.wrap is None:
+            # Only when there's a double linebreak separating list elements,
+            # markdown2 wraps the content of the element inside a <p> element.
+            # In ODT we should always encapsulate list content in a single paragraph.
+            # Here we create the container paragraph in case markdown didn't.
+            parent.wrap = odt_tag is None or odt_tag.split(":")[-1] != "p"
+            if parent.wrap:
+                self._write("<text:p>")
+
+    def _flush_text(self) -> None:
+        text = "".join(self._text)
+        self._text.clear()
+        if not text:
+            return
+        if not self._open:
+            self.chunks.append(_text_to_str(escape_text(text)))
+            return
+
+        self._add_content(None)
+        if self._code_depth:
+            # Every text of code is wrapped in a text:span, with single linebreaks turned into text:line-break
+            text = escape_text(text.lstrip("\n")).replace("\n", "<text:line-break/>")
+            self._write(f"<text:span>{text}</text:span>" if text else "<text:span/>")
+        else:
+            self._write(escape_text(text))
 
-    # Now transform tag attributes
-    if "style_attributes" in transform:
-        for style, attrs in transform["style_attributes"].items():
-            odt_tag.setAttribute("text:{}".format(style), attrs)
 
-    if "attributes" in transform:
-        for name, value in transform["attributes"].items():
-            odt_tag.setAttribute(name, value)
+def _html_attributes(source: str) -> dict[str, str]:
+    attributes = {}
+    for name, double_quoted, single_quoted, unquoted in _HTML_ATTRIBUTE_PATTERN.findall(source):
+        value = double_quoted or single_quoted or unquoted
+        attributes[name.lower()] = unescape(value) if "&" in value else value
+    return attributes
 
-        # Special handling of <a> tags and their href attribute
-        if tag.localName == "a" and tag.hasAttribute("href"):
-            odt_tag.setAttribute("xlink:href", tag.getAttribute("href"))
 
-    tag.parentNode.replaceChild(odt_tag, tag)
+def _text_to_str(text: str) -> str:
+    # All double linebreaks should be converted to an empty paragraph
+    return text.replace("\n\n", '<text:p text:style-name="Standard"/>')
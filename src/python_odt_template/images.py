@@ -0,0 +1,215 @@
+"""
+Image sources for the `image` filters. Besides file paths, a filter accepts
+bytes, file objects, or any value a resolver turns into one of those, e.g. an
+object storage key. Images that are not files on disk are handed over to the
+renderer through a registry scoped to the current render: the filter returns
+a token the renderer looks up when it writes the image frames.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import logging
+import os
+from contextvars import ContextVar
+from dataclasses import dataclass
+from dataclasses import field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import IO
+from typing import Iterator
+from typing import Union
+
+from python_odt_template.template import Image
+from python_odt_template.template import image_cache
+from python_odt_template.template import ImageCache
+from python_odt_template.template import load_image
+
+__all__ = (
+    "ImageLoader",
+    "clear_image_caches",
+    "downscale_image",
+    "image_scope",
+    "register_image",
+    "resolve_frame_image",
+)
+
+logger = logging.getLogger("python_odt_template")
+
+ImageSource = Union[bytes, bytearray, memoryview, IO[bytes], str, os.PathLike, Image]
+
+TOKEN_PREFIX = "odt-image:"
+
+# Results of downscale_image, by source image digest, size and quality
+downscaled_image_cache = ImageCache(max_size=32 * 1024 * 1024)
+
+_rendered_images: ContextVar[dict[str, Image] | None] = ContextVar("rendered_images", default=None)
+
+
+@contextlib.contextmanager
+def image_scope() -> Iterator[dict[str, Image]]:
+    """Collects the images registered by the filters while rendering a document."""
+    images = {}
+    token = _rendered_images.set(images)
+    try:
+        yield images
+    finally:
+        _rendered_images.reset(token)
+
+
+def register_image(image: Image) -> str:
+    """Register *image* for the current render and returns the name to give its frame."""
+    images = _rendered_images.get()
+    if images is None:
+        msg = "In-memory images can only be used while rendering a document"
+        raise RuntimeError(msg)
+    images[image.digest] = image
+    return f"{TOKEN_PREFIX}{image.digest}"
+
+
+def resolve_frame_image(name: str) -> tuple[Image, str] | None:
+    """
+    Returns the image a rendered frame name refers to, either a registered
+    image or a file path, along with the name to give the frame.
+    """
+    if name.startswith(TOKEN_PREFIX):
+        digest = name[len(TOKEN_PREFIX) :]
+        image = (_rendered_images.get() or {}).get(digest)
+        if image is None:
+            logger.debug("Image not registered", extra={"image": name})
+            return None
+        return image, f"image-{digest[:12]}"
+
+    path = Path(name)
+    if not (path.exists() and path.is_file()):
+        logger.debug("Image file not found", extra={"image": path})
+        return None
+    return load_image(path), path.stem
+
+
+@dataclass
+class ImageLoader:
+    """
+    The `image` filter. Paths are relative to *media_path*, bytes and file
+    objects are used as is. Other values, or all of them when it is set, go
+    through *resolver*, which returns bytes, a file object, a path or None to
+    fall back to the default handling. Up to *cache_size* resolved images are
+    kept in memory.
+
+    With *max_size* (width, height), bigger images are downscaled to fit and
+    recompressed with *quality*, this requires Pillow.
+    """
+
+    media_path: Path | str | None = None
+    resolver: Callable[[Any], bytes | IO[bytes] | Path | str | None] | None = None
+    cache_size: int = 0
+    max_size: tuple[int, int] | None = None
+    quality: int = 85
+    _cached_resolve: Callable[[Any], Image | Path | None] | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.resolver is not None and self.cache_size:
+            self._cached_resolve = lru_cache(maxsize=self.cache_size)(self._resolve)
+
+    def __call__(self, value: ImageSource) -> Path | str:
+        image = self.load(value)
+        if isinstance(image, Path):
+            return image
+        return register_image(image)
+
+    def load(self, value: ImageSource) -> Image | Path:
+        """
+        Returns the image for *value*. Files that need no processing are
+        returned as a path, they are read when the document is written.
+        """
+        if isinstance(value, Image):
+            return self._fit(value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self._fit(Image.from_bytes(bytes(value)))
+        # Looked up on the type, undefined template values answer any attribute
+        if hasattr(type(value), "read"):
+            return self._fit(Image.from_bytes(value.read()))
+
+        if self.resolver is not None:
+            resolve = self._cached_resolve or self._resolve
+            try:
+                resolved = resolve(value)
+            except TypeError:
+                # Unhashable value, not cached
+                resolved = self._resolve(value)
+            if resolved is not None:
+                return resolved
+
+        path = Path(self.media_path) / value if self.media_path is not None else Path(value)
+        if self.max_size is None or not path.is_file():
+            return path
+        return self._fit(load_image(path))
+
+    def _resolve(self, value: Any) -> Image | Path | None:
+        resolved = self.resolver(value)
+        if resolved is None:
+            return None
+        if isinstance(resolved, (str, os.PathLike)):
+            path = Path(resolved)
+            return self._fit(load_image(path)) if self.max_size is not None else path
+        return self.load(resolved)
+
+    def _fit(self, image: Image) -> Image:
+        if self.max_size is None:
+            return image
+        return downscale_image(image, tuple(self.max_size), self.quality)
+
+
+def clear_image_caches() -> None:
+    """Drop the image files and downscaled images kept in memory."""
+    image_cache.clear()
+    downscaled_image_cache.clear()
+
+
+def downscale_image(image: Image, max_size: tuple[int, int], quality: int = 85) -> Image:
+    """
+    Returns *image* downscaled to fit in *max_size* and recompressed, or
+    *image* itself when it already fits or is not a raster image. Results
+    are cached in `downscaled_image_cache`.
+    """
+    key = (image.digest, tuple(max_size), quality)
+    downscaled = downscaled_image_cache.get(key)
+    if downscaled is None:
+        downscaled = _downscale_image(image, max_size, quality)
+        downscaled_image_cache.set(key, downscaled)
+    return downscaled
+
+
+def _downscale_image(image: Image, max_size: tuple[int, int], quality: int) -> Image:
+    try:
+        from PIL import Image as PILImage
+        from PIL import ImageOps
+        from PIL import UnidentifiedImageError
+    except ImportError as e:
+        msg = "Downscaling images requires Pillow, install python-odt-template[images]"
+        raise ImportError(msg) from e
+
+    try:
+        picture = PILImage.open(io.BytesIO(image.data))
+    except UnidentifiedImageError:
+        return image
+
+    with picture:
+        if picture.width <= max_size[0] and picture.height <= max_size[1]:
+            return image
+
+        # Phone pictures are often stored sideways with an orientation tag
+        picture = ImageOps.exif_transpose(picture)
+        picture.thumbnail(max_size)
+        output = io.BytesIO()
+        if image.mimetype == "image/jpeg" or picture.mode not in ("RGBA", "LA", "P"):
+            picture.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+            mimetype = "image/jpeg"
+        else:
+            picture.save(output, "PNG", optimize=True)
+            mimetype = "image/png"
+
+    return Image.from_bytes(output.getvalue(), mimetype)
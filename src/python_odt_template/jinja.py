@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import hashlib
 from pathlib import Path
+from typing import Callable
+from typing import Iterator
 
 from jinja2 import Environment
+from jinja2 import Template
 from jinja2 import Undefined
 from markupsafe import Markup
+from python_odt_template.images import ImageLoader
 from python_odt_template.renderer import ODTRenderer
 
 from .filters import odt_markdown
@@ -53,15 +58,38 @@ environment = Environment(
 )
 
 
-def get_odt_renderer(media_path: str | Path, env: Environment = environment) -> ODTRenderer:
-    media_path = Path(media_path)
-
-    def image_filter(value):
-        return media_path / value
+def get_odt_renderer(
+    media_path: str | Path, env: Environment = environment, image_loader: ImageLoader | None = None
+) -> ODTRenderer:
+    """
+    Returns a renderer using *env*. The `image` filter loads images with
+    *image_loader*, by default paths relative to *media_path*, bytes and file
+    objects.
+    """
+    image_filter = image_loader or ImageLoader(Path(media_path))
 
     def render(template_str: str, context: dict) -> str:
         return env.from_string(template_str).render(context)
 
+    def load_template(template_str: str) -> Template:
+        if env.bytecode_cache is None:
+            return env.from_string(template_str)
+
+        # Same as jinja2.BaseLoader.load, with the source hash standing for the
+        # template name: each source gets its own bucket
+        name = hashlib.sha256(template_str.encode()).hexdigest()
+        bucket = env.bytecode_cache.get_bucket(env, name, None, template_str)
+        if bucket.code is None:
+            bucket.code = env.compile(template_str)
+            env.bytecode_cache.set_bucket(bucket)
+        return env.template_class.from_code(env, bucket.code, env.make_globals(None))
+
+    def compile_template(template_str: str) -> Callable[[dict], str]:
+        return load_template(template_str).render
+
+    def compile_stream(template_str: str) -> Callable[[dict], Iterator[str]]:
+        return load_template(template_str).generate
+
     env.filters["pad"] = pad_string
     env.globals["SafeValue"] = Markup
     env.filters["image"] = image_filter
@@ -72,4 +100,6 @@ def get_odt_renderer(media_path: str | Path, env: Environment = environment) ->
         variable_end_string=env.variable_end_string,
         variable_start_string=env.variable_start_string,
         render_func=render,
+        compile_func=compile_template,
+        compile_stream_func=compile_stream,
     )
@@ -1,12 +1,24 @@
 from __future__ import annotations
 
 import abc
+import asyncio
 import logging
+import os
 import platform
+import queue
+import socket
 import subprocess
+import tempfile
+import time
+import xmlrpc.client
 from dataclasses import dataclass
+from dataclasses import field
 from functools import cached_property
 from pathlib import Path
+from typing import Iterable
+
+from python_odt_template.aio import AsyncLimitMixin
+from python_odt_template.tracing import span
 
 logger = logging.getLogger("python_odt_template")
 
@@ -15,7 +27,25 @@ class LibreOfficeError(Exception):
     pass
 
 
-class LOConverter(abc.ABC):
+@dataclass
+class ConversionResult:
+    """Outcome of converting *input_file*, *output_file* is None when the conversion failed."""
+
+    input_file: Path
+    output_file: Path | None = None
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def output_extension(to: str) -> str:
+    """The file extension of the *to* format, which may name an export filter (e.g. "pdf:writer_pdf_Export")."""
+    return to.split(":", 1)[0]
+
+
+class LOConverter(AsyncLimitMixin, abc.ABC):
     @property
     @abc.abstractmethod
     def raise_on_error(self) -> bool: ...
@@ -24,38 +54,229 @@ class LOConverter(abc.ABC):
     @abc.abstractmethod
     def exec_bin(self) -> str: ...
 
-    def run(self, *args) -> None:
-        process = subprocess.run(
+    def run(self, *args, timeout: float | None = None, input: bytes | None = None, check: bool = False) -> bytes:
+        """
+        Run the converter with *args*, feeding it *input*, and returns its
+        output. Errors are raised if *check* or `raise_on_error` is set.
+        """
+        with span("odt.convert", {"odt.converter": self.exec_bin}):
+            process = self._execute(*args, timeout=timeout, input=input)
+        self._check_returncode(process.returncode, process.stderr, check)
+        return process.stdout
+
+    def _execute(self, *args, timeout: float | None = None, input: bytes | None = None) -> subprocess.CompletedProcess:
+        return subprocess.run(
             [self.exec_bin, *args],
+            input=input,
             check=False,
             capture_output=True,
+            timeout=timeout,
         )
-        if process.returncode != 0:
-            logger.error(process.stderr.decode())
-            if self.raise_on_error:
-                raise LibreOfficeError(process.stderr.decode())
+
+    async def arun(self, *args) -> None:
+        """Asynchronous `run`, the process is killed if the call is cancelled or times out."""
+        with span("odt.convert", {"odt.converter": self.exec_bin}):
+            process = await asyncio.create_subprocess_exec(
+                self.exec_bin,
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+        self._check_returncode(process.returncode, stderr)
+
+    def _check_returncode(self, returncode: int, stderr: bytes, check: bool = False) -> None:
+        if returncode != 0:
+            logger.error(stderr.decode())
+            if self.raise_on_error or check:
+                raise LibreOfficeError(stderr.decode())
 
     @abc.abstractmethod
     def convert(self, input_file: str | Path, output_dir: str | Path, to: str = "pdf") -> None: ...
 
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        """
+        Convert the document *data* to the *to* format, errors are always raised.
+
+        Converters that only work on files go through a temporary directory,
+        removed whether the conversion succeeds or not.
+        """
+        with tempfile.TemporaryDirectory(prefix="odt-template-") as directory:
+            input_file = Path(directory) / "document.odt"
+            input_file.write_bytes(data)
+            self.convert(input_file, directory, to)
+            output_file = input_file.with_suffix(f".{output_extension(to)}")
+            if not output_file.exists():
+                # The converter error, if any, has been logged
+                msg = f"The conversion to {to} produced no document"
+                raise LibreOfficeError(msg)
+            return output_file.read_bytes()
+
+    def convert_many(
+        self, input_files: Iterable[str | Path], output_dir: str | Path, to: str = "pdf"
+    ) -> list[ConversionResult]:
+        """
+        Convert each of *input_files* into *output_dir*. A failing file does not
+        stop the others, its result carries the error.
+        """
+        input_files = list(map(Path, input_files))
+        collisions = _output_collisions(input_files, to)
+        results = []
+        for index, input_file in enumerate(input_files):
+            if index in collisions:
+                results.append(collisions[index])
+                continue
+            output_file = Path(output_dir) / f"{input_file.stem}.{output_extension(to)}"
+            try:
+                output_file.write_bytes(self.convert_bytes(input_file.read_bytes(), to))
+            except (LibreOfficeError, OSError) as e:
+                results.append(ConversionResult(input_file, error=e))
+            else:
+                results.append(ConversionResult(input_file, output_file))
+        return results
+
+    async def aconvert(
+        self, input_file: str | Path, output_dir: str | Path, to: str = "pdf", timeout: float | None = None
+    ) -> None:
+        """
+        Asynchronous `convert`, at most `max_concurrency` conversions run at once.
+        Converters without a native asynchronous implementation run `convert`
+        in a thread: a timeout or cancellation stops waiting for it, but the
+        conversion runs to completion and holds its slot until then.
+        """
+        await self._aconvert(input_file, output_dir, to, timeout)
+
+    async def _aconvert(self, input_file: str | Path, output_dir: str | Path, to: str, timeout: float | None) -> None:
+        await self.run_limited(self.convert, input_file, output_dir, to, timeout=timeout)
+
+    async def _arun_limited(self, args: list, timeout: float | None) -> None:
+        # The process is killed on timeout or cancellation, which frees its slot
+        async with self.async_limiter:
+            await asyncio.wait_for(asyncio.wait_for(self.arun(*args), self.timeout), timeout)
+
+
+class InMemoryConverterMixin:
+    """
+    `convert` for converters working on documents in memory: the file is
+    converted by `convert_bytes` and the result written into *output_dir*.
+    """
+
+    def convert(self, input_file: str | Path, output_dir: str | Path, to: str = "pdf") -> None:
+        try:
+            converted = self.convert_bytes(Path(input_file).read_bytes(), to)
+        except LibreOfficeError as e:
+            logger.error(str(e))
+            if self.raise_on_error:
+                raise
+            return
+        (Path(output_dir) / f"{Path(input_file).stem}.{output_extension(to)}").write_bytes(converted)
+
 
 @dataclass
 class LibreOffice(LOConverter):
     raise_on_error: bool = False
+    # Files converted by a single soffice invocation in convert_many
+    batch_size: int = 50
+    timeout: float | None = None
 
     @cached_property
     def exec_bin(self) -> str:
         return "/Applications/LibreOffice.app/Contents/MacOS/soffice" if platform.system() == "Darwin" else "soffice"
 
     def convert(self, input_file: str | Path, output_dir: str | Path, to: str = "pdf") -> None:
-        self.run(
+        self.run(*self.convert_args(input_file, output_dir, to), timeout=self.timeout)
+
+    async def _aconvert(self, input_file: str | Path, output_dir: str | Path, to: str, timeout: float | None) -> None:
+        await self._arun_limited(self.convert_args(input_file, output_dir, to), timeout)
+
+    def convert_many(
+        self, input_files: Iterable[str | Path], output_dir: str | Path, to: str = "pdf"
+    ) -> list[ConversionResult]:
+        """
+        Convert *input_files* into *output_dir*, up to `batch_size` files per
+        soffice invocation.
+        """
+        input_files = list(map(Path, input_files))
+        collisions = _output_collisions(input_files, to)
+        batches = _batches((f for index, f in enumerate(input_files) if index not in collisions), self.batch_size)
+        converted = (result for batch in batches for result in self._convert_batch(batch, Path(output_dir), to))
+        return [collisions[index] if index in collisions else next(converted) for index in range(len(input_files))]
+
+    def _convert_batch(self, input_files: list[Path], output_dir: Path, to: str) -> list[ConversionResult]:
+        output_files = [output_dir / f"{input_file.stem}.{output_extension(to)}" for input_file in input_files]
+        # An output left by a previous run does not count as converted
+        previous = {output_file: _mtime_ns(output_file) for output_file in output_files}
+
+        try:
+            process = self._execute(*self.convert_args(input_files, output_dir, to), timeout=self.timeout)
+            returncode, stderr = process.returncode, process.stderr.decode().strip()
+        except (subprocess.TimeoutExpired, OSError) as e:
+            # A missing or unusable soffice fails the files of the batch
+            returncode, stderr = None, str(e)
+
+        results = []
+        for input_file, output_file in zip(input_files, output_files):
+            mtime_ns = _mtime_ns(output_file)
+            if mtime_ns is not None and mtime_ns != previous[output_file]:
+                results.append(ConversionResult(input_file, output_file))
+            else:
+                error = LibreOfficeError(f"{input_file} was not converted to {to}: {stderr or 'no output'}")
+                results.append(ConversionResult(input_file, error=error))
+
+        # soffice prints harmless warnings on success, e.g. about the JRE
+        if returncode != 0 or not all(result.ok for result in results):
+            logger.error(stderr or f"soffice exited with {returncode}")
+        return results
+
+    def convert_args(self, input_file: str | Path | list[Path], output_dir: str | Path, to: str = "pdf") -> list:
+        input_files = input_file if isinstance(input_file, list) else [input_file]
+        return [
             "--headless",
             "--convert-to",
-            "pdf",
+            to,
             "--outdir",
             output_dir,
-            input_file,
-        )
+            *input_files,
+        ]
+
+
+def _output_collisions(input_files: list[Path], to: str) -> dict[int, ConversionResult]:
+    """
+    The failed results of the files whose output, named after the input,
+    would overwrite the output of an earlier file, by index.
+    """
+    first_inputs = {}
+    collisions = {}
+    for index, input_file in enumerate(input_files):
+        name = f"{input_file.stem}.{output_extension(to)}"
+        first_input = first_inputs.setdefault(name, input_file)
+        if first_input is not input_file:
+            msg = f"{input_file} was not converted to {to}: {name} is the output of {first_input} as well"
+            collisions[index] = ConversionResult(input_file, error=LibreOfficeError(msg))
+    return collisions
+
+
+def _batches(input_files: Iterable[Path], size: int) -> Iterable[list[Path]]:
+    batch = []
+    for input_file in input_files:
+        if len(batch) >= size:
+            yield batch
+            batch = []
+        batch.append(input_file)
+    if batch:
+        yield batch
+
+
+def _mtime_ns(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
 @dataclass
@@ -63,23 +284,227 @@ class UnoConvert(LOConverter):
     host: str = "127.0.0.1"
     port: int = 2003
     raise_on_error: bool = False
+    timeout: float | None = None
 
     @cached_property
     def exec_bin(self) -> str:
         return "unoconvert"
 
     def convert(self, input_file: str | Path, output_dir: str | Path, to: str = "pdf") -> None:
-        self.run(
+        self.run(*self.convert_args(input_file, output_dir, to), timeout=self.timeout)
+
+    async def _aconvert(self, input_file: str | Path, output_dir: str | Path, to: str, timeout: float | None) -> None:
+        await self._arun_limited(self.convert_args(input_file, output_dir, to), timeout)
+
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        """Convert the document *data* to the *to* format through stdin and stdout, errors are always raised."""
+        args = self.convert_args("-", None, to)
+        if filtername:
+            args += ["--filter", filtername]
+        return self.run(*args, timeout=self.timeout, input=data, check=True)
+
+    def convert_args(self, input_file: str | Path, output_dir: str | Path | None, to: str = "pdf") -> list:
+        """Arguments converting *input_file* into *output_dir*, or from stdin to stdout for "-" and None."""
+        output_file = (
+            "-" if output_dir is None else Path(output_dir) / f"{Path(input_file).stem}.{output_extension(to)}"
+        )
+        return [
             input_file,
-            Path(output_dir) / (Path(input_file).stem + f".{to}"),
+            output_file,
             "--convert-to",
             to,
             "--port",
             str(self.port),
             "--host",
             self.host,
+        ]
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout: float | None):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+@dataclass
+class UnoClientConverter(InMemoryConverterMixin, LOConverter):
+    """
+    Converts documents by calling a running unoserver over XML-RPC, from the
+    current process. Documents are sent and received in memory, the server
+    does not need access to the caller's filesystem.
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 2003
+    raise_on_error: bool = False
+    timeout: float | None = None
+
+    def __post_init__(self):
+        # ServerProxy instances are not thread safe, idle ones are kept for reuse
+        self._proxies: queue.LifoQueue[xmlrpc.client.ServerProxy] = queue.LifoQueue()
+
+    @cached_property
+    def exec_bin(self) -> str:
+        # Nothing is executed, this is the program served on the other end
+        return "unoserver"
+
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        """Convert the document *data* to the *to* format, errors are always raised."""
+        try:
+            proxy = self._proxies.get_nowait()
+        except queue.Empty:
+            proxy = xmlrpc.client.ServerProxy(
+                f"http://{self.host}:{self.port}", allow_none=True, transport=_TimeoutTransport(self.timeout)
+            )
+
+        attributes = {"odt.converter": "unoserver", "odt.format": to, "odt.document.bytes": len(data)}
+        try:
+            with span("odt.convert", attributes) as current:
+                # inpath, indata, outpath, convert_to, filtername, filter_options, update_index
+                result = proxy.convert(None, data, None, to, filtername, [], True)
+                current.set_attribute("odt.output.bytes", len(result.data))
+        except (xmlrpc.client.Error, OSError) as e:
+            raise LibreOfficeError(str(e)) from e
+
+        self._proxies.put(proxy)
+        return result.data
+
+
+@dataclass
+class _PoolWorker:
+    converter: UnoClientConverter
+    process: subprocess.Popen | None = None
+    profile_dir: tempfile.TemporaryDirectory | None = None
+    jobs: int = 0
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self) -> None:
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.profile_dir is not None:
+            self.profile_dir.cleanup()
+        self.process = None
+        self.profile_dir = None
+        self.jobs = 0
+
+
+@dataclass
+class LibreOfficePool(InMemoryConverterMixin, LOConverter):
+    """
+    A pool of long-lived headless LibreOffice instances, each one served by
+    its own unoserver process with a dedicated user profile and ports.
+
+    Worker *i* listens on `port + 2 * i` (XML-RPC) and `port + 2 * i + 1` (UNO).
+    Workers are started on first use, restarted when they crash or a
+    conversion exceeds *timeout*, and recycled after *max_jobs* conversions.
+    unoserver runs under the `UNOSERVER_PYTHON` interpreter when that variable
+    is set (see `python_odt_template.unoserver`), *server_command* overrides it.
+    """
+
+    size: int = 2
+    host: str = "127.0.0.1"
+    port: int = 2003
+    max_jobs: int = 200
+    timeout: float | None = 120
+    startup_timeout: float = 30
+    raise_on_error: bool = False
+    server_command: list[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._workers: queue.Queue[_PoolWorker] = queue.Queue()
+        for index in range(self.size):
+            converter = UnoClientConverter(host=self.host, port=self.port + 2 * index, timeout=self.timeout)
+            self._workers.put(_PoolWorker(converter=converter))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @cached_property
+    def exec_bin(self) -> str:
+        return "unoserver"
+
+    def stop(self) -> None:
+        """Stop every worker, waiting for running conversions to finish."""
+        workers = [self._workers.get() for _ in range(self.size)]
+        for worker in workers:
+            worker.stop()
+            self._workers.put(worker)
+
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        """Convert the document *data* on the next idle worker, errors are always raised."""
+        worker = self._workers.get()
+        try:
+            if not worker.is_alive() or worker.jobs >= self.max_jobs:
+                worker.stop()
+                self._start_worker(worker)
+            worker.jobs += 1
+            return worker.converter.convert_bytes(data, to, filtername)
+        except LibreOfficeError as e:
+            if isinstance(e.__cause__, socket.timeout) or not worker.is_alive():
+                # The instance hung or crashed, it is restarted on next use
+                worker.stop()
+            raise
+        finally:
+            self._workers.put(worker)
+
+    def _server_command(self) -> list[str]:
+        if self.server_command:
+            return list(self.server_command)
+        uno_python = os.getenv("UNOSERVER_PYTHON")
+        return [uno_python, "-m", "unoserver.server"] if uno_python else [self.exec_bin]
+
+    def _start_worker(self, worker: _PoolWorker) -> None:
+        port = worker.converter.port
+        worker.profile_dir = tempfile.TemporaryDirectory(prefix="odt-template-lo-", ignore_cleanup_errors=True)
+        worker.process = subprocess.Popen(
+            [
+                *self._server_command(),
+                "--executable",
+                LibreOffice().exec_bin,
+                "--interface",
+                self.host,
+                "--port",
+                str(port),
+                "--uno-port",
+                str(port + 1),
+                "--user-installation",
+                Path(worker.profile_dir.name).as_uri(),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
         )
 
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if not worker.is_alive():
+                msg = f"unoserver on port {port} exited with code {worker.process.returncode}"
+                worker.stop()
+                raise LibreOfficeError(msg)
+            try:
+                with socket.create_connection((self.host, port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+
+        worker.stop()
+        msg = f"unoserver on port {port} did not start within {self.startup_timeout} seconds"
+        raise LibreOfficeError(msg)
+
 
 libreoffice = LibreOffice()
 unoconvert = UnoConvert()
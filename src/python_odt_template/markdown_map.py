@@ -1,14 +1,15 @@
-from random import randint
-
 """
-    Transform map used by the markdown filter. transform_map has
-    instructions of how to transform a HTML style tag into a ODT document tag.
-    Some ODT tags may need extra attributes. Those are defined as a dict in
-    'style_attributes' property.
+Transform map used by the markdown filter. transform_map has
+instructions of how to transform a HTML style tag into a ODT document tag.
+Some ODT tags may need extra attributes. Those are defined as a dict in
+'style_attributes' property.
+
+Some tags also may need to create new styles in the document. If this is
+the case, a "style" property should be defined with name of the style to
+create and a "properties" attribute defining style:text-properties values.
 
-    Some tags also may need to create new styles in the document. If this is
-    the case, a "style" property should be defined with name of the style to
-    create and a "properties" attribute defining style:text-properties values.
+Tags given an "id_prefix" get an xml:id made of the prefix and a number
+derived from the markdown source, the same markdown always gets the same ids.
 """
 
 common_styles = {
@@ -76,11 +77,11 @@ transform_map = {
     },
     "ul": {
         "replace_with": "text:list",
-        "attributes": {"xml:id": "list" + str(randint(100000000000000000, 900000000000000000))},
+        "id_prefix": "list",
     },
     "ol": {
         "replace_with": "text:list",
-        "attributes": {"xml:id": "list" + str(randint(100000000000000000, 900000000000000000))},
+        "id_prefix": "list",
     },
     "li": {"replace_with": "text:list-item"},
     "br": {"replace_with": "text:line-break"},
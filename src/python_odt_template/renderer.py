@@ -1,24 +1,68 @@
 from __future__ import annotations
 
+import contextlib
+import html
+import io
+import json
 import logging
+import os
 import re
+import zipfile
+from concurrent.futures import Executor
 from dataclasses import dataclass
+from functools import partial
+from functools import wraps
+from itertools import islice
 from pathlib import Path
 from typing import Callable
+from typing import IO
+from typing import Iterable
+from typing import Iterator
 from typing import TYPE_CHECKING
 from urllib.parse import unquote
 from xml.parsers.expat import ExpatError
 
-from defusedxml.minidom import parseString
 from markupsafe import Markup
+from python_odt_template.aio import AsyncLimitMixin
+from python_odt_template.images import image_scope
+from python_odt_template.images import resolve_frame_image
+from python_odt_template.libreoffice import libreoffice
+from python_odt_template.template import add_manifest_entry
+from python_odt_template.template import get_image_media_path
+from python_odt_template.template import ODTTemplate
+from python_odt_template.tracing import span
+from python_odt_template.xmlbackend import escape_attribute
+from python_odt_template.xmlbackend import get_backend
+from python_odt_template.xmlbackend import NAMESPACES
+from python_odt_template.xmlbackend import parse_xml
+from python_odt_template.xmlbackend import qname
+from python_odt_template.xmlbackend import TreeEdits
 
 if TYPE_CHECKING:
-    from python_odt_template import ODTTemplate
-    from xml.dom.minidom import Document
-    from xml.dom.minidom import Node
+    from python_odt_template.libreoffice import LOConverter
+    from python_odt_template.template import Image
+    from python_odt_template.xmlbackend import Element
+    from python_odt_template.xmlbackend import XMLDocument
 
 logger = logging.getLogger("python_odt_template")
 
+
+class InvalidXMLError(ExpatError):
+    """
+    A rendered XML part is not well-formed, e.g. a template tag broke the
+    markup. The message shows the rendered text around the error, located by
+    *lineno* and *offset* (from 0). It subclasses the ExpatError raised
+    before the XML backends, whichever backend parsed the part.
+    """
+
+    def __init__(self, msg: str, lineno: int, offset: int):
+        super().__init__(msg)
+        self.lineno = lineno
+        self.offset = offset
+
+
+_SECRETARY_LINK_PATTERN = re.compile(r"(?is)(xlink:href=\")secretary:(.*?)(\")")
+
 FLOW_REFERENCES = {
     "text:p": "text:p",
     "paragraph": "text:p",
@@ -42,12 +86,23 @@ FLOW_REFERENCES = {
 
 
 @dataclass
-class ODTRenderer:
+class ODTRenderer(AsyncLimitMixin):
     block_start_string: str
     block_end_string: str
     variable_start_string: str
     variable_end_string: str
     render_func: Callable[[str, dict], str]
+    compile_func: Callable[[str], Callable[[dict], str]] | None = None
+    # Compiles a template into a callable rendering it in chunks
+    compile_stream_func: Callable[[str], Callable[[dict], Iterable[str]]] | None = None
+    # Write rendered parts to the archive as text instead of parsing and
+    # serializing them again, images are resolved with a pass over the text.
+    splice_xml: bool = False
+    # Check that spliced parts are well-formed, at the cost of a parse
+    validate_xml: bool = False
+    # Compiled templates write the content to the archive while it is
+    # rendered, as with splice_xml but without holding it in memory.
+    stream_xml: bool = False
 
     def __post_init__(self):
         self._compile_tags_expressions()
@@ -65,6 +120,7 @@ class ODTRenderer:
     def _compile_escape_expressions(self):
         # Compiles escape expressions
         self.escape_map = {}
+        self.escape_entities = {}
         unescape_rules = {
             r"&gt;": r">",
             r"&lt;": r"<",
@@ -86,50 +142,60 @@ class ODTRenderer:
             )
 
             self.escape_map[k] = rf"\1{value}\4"
+            self.escape_entities[k] = key
+
+        # Template tags, the escape expressions can only match within one
+        self.tag_span_pattern = re.compile(
+            rf"(?is)(?:{re.escape(self.variable_start_string)}|{re.escape(self.block_start_string)})"
+            rf".*?(?:{re.escape(self.variable_end_string)}|{re.escape(self.block_end_string)})"
+        )
 
     def _is_template_tag(self, tag: str):
         """
         Returns True is tag (str) is a valid template instruction tag.
         """
 
-        return len(self.tag_pattern.findall(tag)) > 0
+        return self.tag_pattern.search(tag) is not None
 
     def _is_block_tag(self, tag: str):
         """
         Returns True is tag (str) is a template flow control tag.
         """
-        return len(self.block_pattern.findall(tag)) > 0
+        return self.block_pattern.search(tag) is not None
 
-    def _tags_in_document(self, document: Document):
+    def _tags_in_document(self, document: XMLDocument) -> Iterator[tuple[Element, str]]:
         """
-        Yields a list of available template instructions tags in document.
+        Yields the available template instructions tags in document, along
+        with their content.
         """
-        tags = document.getElementsByTagName("text:text-input")
-
-        for tag in tags:
-            if not tag.hasChildNodes():
+        for tag in document.iter("text:text-input"):
+            if not tag.text:
                 continue
 
-            content = tag.childNodes[0].data.strip()
+            content = tag.text.strip()
             if not self._is_template_tag(content):
                 continue
 
-            yield tag
+            yield tag, content
 
-    def _census_tags(self, document: Document):
+    def _census_tags(self, document: XMLDocument, tags: list[Element]) -> dict[Element, int]:
         """
-        Make a census of all available template tags in document. We count all
-        the children tags nodes within their parents. This process is necesary
-        to automaticaly avoid generating invalid documents when mixing block
-        tags in differents parts of a document.
+        Make a census of the template *tags* of document. We count all the
+        children tags nodes within their parents. This process is necesary to
+        automaticaly avoid generating invalid documents when mixing block tags
+        in differents parts of a document. The counts are returned as a side
+        table keyed by node.
         """
-        for tag in self._tags_in_document(document):
-            content = tag.childNodes[0].data.strip()
-            is_block = self._is_block_tag(content)
+        tags_count = {}
+        for tag in tags:
+            node = document.parent(tag)
+            while node is not None:
+                tags_count[node] = tags_count.get(node, 0) + 1
+                node = document.parent(node)
 
-            count_node_descendant_tags(tag.parentNode, is_block)
+        return tags_count
 
-    def _prepare_tags(self, document: Document):
+    def _prepare_tags(self, document: XMLDocument):
         """Here we search for every field node present in xml_document.
         For each field we found we do:
         * if field is a print field ({{ field }}), we replace it with a
@@ -169,7 +235,12 @@ class ODTRenderer:
           </table>
         """
 
-        self._census_tags(document)
+        fields = list(self._tags_in_document(document))
+        tags_count = self._census_tags(document, [tag for tag, _ in fields])
+
+        # Placeholders are found on the original tree, the edits are applied
+        # once all fields are processed so that each parent is rebuilt once.
+        edits = TreeEdits(document)
 
         # We have to replace a node, let's call it "placeholder", with the
         # content of our jinja tag. The placeholder can be a node with all its
@@ -177,11 +248,10 @@ class ODTRenderer:
         # can scale up in the tree hierarchy to get our placeholder node. When
         # said attribute is not present, then we scale up until we find a
         # common parent for this tag and any other tag.
-        for tag in self._tags_in_document(document):
+        for tag, content in fields:
             placeholder = tag
-            content = tag.childNodes[0].data.strip()
             is_block = self._is_block_tag(content)
-            scale_to = tag.getAttribute("text:description").strip().lower()
+            scale_to = tag.get(qname("text:description"), "").strip().lower()
 
             if content.lower().find("|odt_markdown") > 0:
                 # Take whole paragraph when handling a markdown field
@@ -189,57 +259,58 @@ class ODTRenderer:
 
             if scale_to:
                 if FLOW_REFERENCES.get(scale_to, False):
-                    placeholder = get_node_parent_of_name(tag, FLOW_REFERENCES[scale_to])
-
-                new_node = document.createTextNode(content)
+                    placeholder = get_node_parent_of_name(document, tag, FLOW_REFERENCES[scale_to])
 
             elif is_block:
                 # expand up the placeholder until a shared parent is found
-                while not placeholder.parentNode.tags_count > 1:
-                    placeholder = placeholder.parentNode
-
-                if placeholder:
-                    new_node = document.createTextNode(content)
-
-            else:
-                new_node = document.createElement("text:span")
-                text_node = document.createTextNode(content)
-                new_node.appendChild(text_node)
-
-            placeholder_parent = placeholder.parentNode
-            if not scale_to.startswith("after::"):
-                placeholder_parent.insertBefore(new_node, placeholder)
-            elif placeholder.isSameNode(placeholder_parent.lastChild):
-                placeholder_parent.appendChild(new_node)
+                while not tags_count.get(document.parent(placeholder), 0) > 1:
+                    placeholder = document.parent(placeholder)
+
+            if scale_to or is_block:
+                if scale_to.startswith("after::"):
+                    edits.insert_text_after(placeholder, content)
+                else:
+                    edits.insert_text_before(placeholder, content)
             else:
-                placeholder_parent.insertBefore(new_node, placeholder.nextSibling)
+                edits.insert_before(placeholder, document.create_element("text:span", text=content))
 
             if scale_to.startswith(("after::", "before::")):
                 # Don't remove whole field tag, only "text:text-input" container
-                placeholder = get_node_parent_of_name(tag, "text:p")
-                placeholder_parent = placeholder.parentNode
+                placeholder = get_node_parent_of_name(document, tag, "text:p")
 
             # Finally, remove the placeholder
-            placeholder_parent.removeChild(placeholder)
+            edits.remove(placeholder)
+
+        edits.apply()
+        return len(fields)
 
     def _unescape_entities(self, xml_text: str):
         """
         Unescape links and '&amp;', '&lt;', '&quot;' and '&gt;' within jinja
         instructions. The regexs rules used here are compiled in
-        _compile_escape_expressions.
+        _compile_escape_expressions. The document is scanned once for
+        template tags, the rules are only applied to tags holding entities.
         """
-        for regexp, replacement in self.escape_map.items():
-            while True:
-                xml_text, substitutions = regexp.subn(replacement, xml_text)
-                if not substitutions:
-                    break
 
+        def unescape_tag(match):
+            tag = match.group()
+            if "&" not in tag:
+                return tag
+
+            for regexp, replacement in self.escape_map.items():
+                # The expressions ignore case, casefold() never misses a match
+                while self.escape_entities[regexp] in tag.casefold():
+                    tag, substitutions = regexp.subn(replacement, tag)
+                    if not substitutions:
+                        break
+            return tag
+
+        xml_text = self.tag_span_pattern.sub(unescape_tag, xml_text)
         return self._unescape_links(xml_text)
 
     def _unescape_links(self, xml_text: str):
         """Fix Libreoffice auto escaping of xlink:href attribute values.
         This unescaping is only done on 'secretary' scheme URLs."""
-        robj = re.compile(r"(?is)(xlink:href=\")secretary:(.*?)(\")")
 
         def replacement(match):
             return Markup(
@@ -252,95 +323,609 @@ class ODTRenderer:
                 )
             )
 
-        while True:
-            xml_text, rep = robj.subn(replacement, xml_text)
+        while "secretary:" in xml_text.casefold():
+            xml_text, rep = _SECRETARY_LINK_PATTERN.subn(replacement, xml_text)
             if not rep:
                 break
 
         return xml_text
 
-    def render_xml(self, xml_document: Document, context: dict) -> Document:
-        self._prepare_tags(xml_document)
-        xml_source = xml_document.toxml()
-        rendered_xml = self.render_func(self._unescape_entities(xml_source), context)
-
-        try:
-            return parseString(rendered_xml.encode("ascii", "xmlcharrefreplace"))
-        except ExpatError as e:
-            n_context_chars = 38
-            line = rendered_xml.split("\n")[e.lineno - 1]
-            lower = max(0, e.offset - n_context_chars)
-            upper = min(e.offset + n_context_chars, len(line))
-            error_context = line[lower:upper]
-            sep = "-" * (e.offset - lower) + "^"
-            e.args = (f"Invalid XML near line {e.lineno}, column {e.offset}\n{error_context}\n{sep}",)
-            raise
+    def prepare_xml(self, xml_document: XMLDocument) -> str:
+        """
+        Prepare template tags in *xml_document* and returns the template source
+        ready to be handed to the template engine.
+        """
+        with span("odt.prepare") as current:
+            current.set_attribute("odt.fields", self._prepare_tags(xml_document))
+            source = self._unescape_entities(xml_document.toxml())
+            current.set_attribute("odt.xml.bytes", len(source))
+        return source
+
+    def compile_source(self, template_str: str) -> Callable[[dict], str]:
+        """
+        Compile a prepared template source with the template engine. The
+        returned callable renders the compiled template against a context.
+        """
+        if self.compile_func is not None:
+            return self.compile_func(template_str)
+        return partial(self.render_func, template_str)
+
+    def compile_stream(self, template_str: str) -> Callable[[dict], Iterable[str]]:
+        """
+        Like `compile_source`, the returned callable yields the rendered
+        template in chunks. Engines without streaming yield it in one chunk.
+        """
+        if self.compile_stream_func is not None:
+            return self.compile_stream_func(template_str)
+        render = self.compile_source(template_str)
+        return lambda context: iter((render(context),))
+
+    def prepare(self, template: ODTTemplate | str | Path | bytes | IO[bytes]) -> PreparedODTTemplate:
+        """
+        Prepare the content and styles of *template* for the template engine.
+        The result is engine agnostic and can be pickled.
+        """
+        if not isinstance(template, ODTTemplate):
+            with ODTTemplate(template) as odt_template:
+                return self.prepare(odt_template)
+
+        return PreparedODTTemplate(
+            source=template.source,
+            content=self.prepare_xml(template.content),
+            styles=self.prepare_xml(template.styles),
+            manifest=template.manifest.toxml(),
+        )
+
+    def precompile(
+        self, template: ODTTemplate | str | Path | bytes | IO[bytes], target: str | Path | IO[bytes]
+    ) -> PreparedODTTemplate:
+        """
+        Prepare *template* and write it to *target*, e.g. at deploy time. The
+        artifact is turned back into a compiled template by `load_compiled`
+        without parsing the document again.
+        """
+        prepared = self.prepare(template)
+        prepared.dump(target, self.delimiters)
+        return prepared
+
+    def load_compiled(self, source: str | Path | IO[bytes]) -> CompiledODTTemplate:
+        """Compile the artifact written by `precompile`."""
+        return self.compile(PreparedODTTemplate.load(source, self.delimiters))
+
+    @property
+    def delimiters(self) -> tuple[str, str, str, str]:
+        return (
+            self.block_start_string,
+            self.block_end_string,
+            self.variable_start_string,
+            self.variable_end_string,
+        )
+
+    def compile(
+        self, template: ODTTemplate | PreparedODTTemplate | str | Path | bytes | IO[bytes]
+    ) -> CompiledODTTemplate:
+        """
+        Unpack, parse, prepare and compile *template* once, the result can be
+        rendered any number of times. The parsed XML parts of *template* are
+        dropped, renders only need the prepared sources and the archive.
+        """
+        if isinstance(template, PreparedODTTemplate):
+            prepared = template
+            template = ODTTemplate(prepared.source)
+        else:
+            if not isinstance(template, ODTTemplate):
+                template = ODTTemplate(template)
+            prepared = self.prepare(template)
+            template.documents.clear()
+            template.reindex_styles()
+
+        render_content_stream = None
+        if self.stream_xml:
+            render_content_stream = self.compile_stream(prepared.content)
+            render_content = _joined(render_content_stream)
+        else:
+            render_content = self.compile_source(prepared.content)
+
+        return CompiledODTTemplate(
+            template=template,
+            prepared=prepared,
+            render_content=render_content,
+            render_styles=self.compile_source(prepared.styles),
+            splice_xml=self.splice_xml or self.stream_xml,
+            validate_xml=self.validate_xml,
+            render_content_stream=render_content_stream,
+        )
+
+    def render_text(self, xml_document: XMLDocument, context: dict) -> str:
+        """Render *xml_document* and returns the rendered XML source."""
+        return render_source(partial(self.render_func, self.prepare_xml(xml_document)), context)
+
+    def render_xml(self, xml_document: XMLDocument, context: dict) -> XMLDocument:
+        return parse_rendered_xml(self.render_text(xml_document, context))
 
     def render(self, template: ODTTemplate, context: dict) -> None:
+        with image_scope(), span("odt.document"):
+            self._render(template, context)
+
+    def _render(self, template: ODTTemplate, context: dict) -> None:
+        if self.splice_xml or self.stream_xml:
+            # The whole rendered content is kept, not only its office:body
+            content = render_images_in_text(self.render_text(template.content, context), template.add_image)
+            styles = self.render_text(template.styles, context)
+            if self.validate_xml:
+                parse_rendered_xml(content)
+                parse_rendered_xml(styles)
+            template.write_file("content.xml", content)
+            template.write_file("styles.xml", styles)
+            return
+
         rendered_content = self.render_xml(template.content, context)
         render_images(rendered_content, image_writer=template.add_image)
-        template.content.getElementsByTagName("office:document-content")[0].replaceChild(
-            rendered_content.getElementsByTagName("office:body")[0],
-            template.content.getElementsByTagName("office:body")[0],
-        )
+        template.content.replace(template.content.find("office:body"), rendered_content.find("office:body"))
 
         template.styles = self.render_xml(template.styles, context)
 
+    def render_to(
+        self, template: ODTTemplate, context: dict, format: str = "pdf", converter: LOConverter | None = None
+    ) -> bytes:
+        """
+        Render *context* into *template* and returns the document converted to
+        *format* by *converter*, LibreOffice by default. The document is handed
+        to the converter in memory.
+        """
+        self.render(template, context)
+        return convert_document(template.pack_bytes(), format, converter)
+
+    async def arender(
+        self, template: ODTTemplate, context: dict, timeout: float | None = None, executor: Executor | None = None
+    ) -> None:
+        """
+        Asynchronous `render`, run in *executor* so the event loop is not blocked.
+        At most `max_concurrency` renders run at once. A render that times out
+        or is cancelled still runs to completion, holding its slot until then.
+        """
+        await self.run_limited(self.render, template, context, timeout=timeout, executor=executor)
+
+
+# Bumped whenever the prepared sources or the artifact layout change
+ARTIFACT_FORMAT = 1
 
-def render_images(xml_document: Document, image_writer: Callable[[Path, str], str]):
+
+@dataclass
+class PreparedODTTemplate:
+    """
+    A template whose tags have been prepared by `ODTRenderer.prepare`: the
+    source archive along with the template sources of its XML parts.
+    """
+
+    source: bytes
+    content: str
+    styles: str
+    manifest: str
+
+    def dump(self, target: str | Path | IO[bytes], delimiters: tuple[str, ...] = ()) -> None:
+        """
+        Write the prepared template to *target* as a zip archive. The
+        *delimiters* of the renderer that prepared it are recorded, the
+        template sources are only valid for the same delimiters.
+        """
+        info = {"format": ARTIFACT_FORMAT, "delimiters": list(delimiters)}
+        with zipfile.ZipFile(target, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("artifact.json", json.dumps(info))
+            archive.writestr("template.odt", self.source)
+            archive.writestr("content.xml", self.content)
+            archive.writestr("styles.xml", self.styles)
+            archive.writestr("manifest.xml", self.manifest)
+
+    @classmethod
+    def load(cls, source: str | Path | IO[bytes], delimiters: tuple[str, ...] = ()) -> PreparedODTTemplate:
+        """
+        Read a prepared template written by `dump`. Raises ValueError when the
+        artifact was written by an incompatible version or, if *delimiters*
+        are given, prepared with other delimiters.
+        """
+        with zipfile.ZipFile(source, "r") as archive:
+            info = json.loads(archive.read("artifact.json"))
+            if info.get("format") != ARTIFACT_FORMAT:
+                msg = f"Unsupported template artifact format: {info.get('format')}"
+                raise ValueError(msg)
+            if delimiters and tuple(info["delimiters"]) != tuple(delimiters):
+                msg = f"Template artifact prepared for delimiters {info['delimiters']}, not {list(delimiters)}"
+                raise ValueError(msg)
+            return cls(
+                source=archive.read("template.odt"),
+                content=archive.read("content.xml").decode(),
+                styles=archive.read("styles.xml").decode(),
+                manifest=archive.read("manifest.xml").decode(),
+            )
+
+
+@dataclass
+class CompiledODTTemplate(AsyncLimitMixin):
+    """
+    A template prepared and compiled once by `ODTRenderer.compile`. Rendering
+    only runs the compiled template engine and repacks the document, the
+    underlying `ODTTemplate` is left untouched.
+    """
+
+    template: ODTTemplate
+    prepared: PreparedODTTemplate
+    render_content: Callable[[dict], str]
+    render_styles: Callable[[dict], str]
+    splice_xml: bool = False
+    validate_xml: bool = False
+    # Set when the content is rendered in chunks, see ODTRenderer.stream_xml
+    render_content_stream: Callable[[dict], Iterable[str]] | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.template.__exit__(exc_type, exc_val, exc_tb)
+
+    def render(self, context: dict) -> bytes:
+        zip_file = io.BytesIO()
+        self.write(context, zip_file)
+        return zip_file.getvalue()
+
+    def render_to(self, context: dict, format: str = "pdf", converter: LOConverter | None = None) -> bytes:
+        """
+        Render *context* and returns the document converted to *format* by
+        *converter*, LibreOffice by default. The document is handed to the
+        converter in memory.
+        """
+        return convert_document(self.render(context), format, converter)
+
+    async def arender(self, context: dict, timeout: float | None = None, executor: Executor | None = None) -> bytes:
+        """
+        Asynchronous `render`, run in *executor* so the event loop is not blocked.
+        At most `max_concurrency` renders run at once. A render that times out
+        or is cancelled still runs to completion, holding its slot until then.
+        """
+        return await self.run_limited(self.render, context, timeout=timeout, executor=executor)
+
+    def write(self, context: dict, target: str | Path | IO[bytes]) -> None:
+        """
+        Render *context* and write the document to a file path or a writable
+        stream. A file is removed when the render fails while it is written,
+        as a streamed content does.
+        """
+        members = self.render_members(context)
+        if isinstance(target, (str, os.PathLike)):
+            try:
+                with open(target, "wb") as file:
+                    self.template.write_archive(file, overrides=members)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(target)
+                raise
+        else:
+            self.template.write_archive(target, overrides=members)
+
+    def render_members(self, context: dict) -> dict[str, str | bytes | Iterator[bytes]]:
+        """
+        Render *context* and returns the archive members that differ from the
+        template. A streamed content is an iterator rendering it as it is
+        consumed, which adds its images and manifest to the returned members.
+        """
+        if self.render_content_stream is not None:
+            members = {"styles.xml": self._render_styles_text(context)}
+            members["content.xml"] = self._stream_content(context, members)
+            return members
+
+        with image_scope(), span("odt.document"):
+            return self._render_members(context)
+
+    def _render_members(self, context: dict) -> dict[str, str | bytes]:
+        images = {}
+        manifest_entries = []
+        image_writer = self._image_writer(images, manifest_entries)
+
+        if self.splice_xml:
+            content = render_images_in_text(render_source(self.render_content, context), image_writer)
+            styles = render_source(self.render_styles, context)
+            if self.validate_xml:
+                parse_rendered_xml(content)
+                parse_rendered_xml(styles)
+        else:
+            content_document = parse_rendered_xml(render_source(self.render_content, context))
+            render_images(content_document, image_writer=image_writer)
+            content = content_document.toxml()
+            styles = parse_rendered_xml(render_source(self.render_styles, context)).toxml()
+
+        members = {"content.xml": content, "styles.xml": styles, **images}
+        if manifest_entries:
+            members["META-INF/manifest.xml"] = self._manifest_with(manifest_entries)
+        return members
+
+    def _render_styles_text(self, context: dict) -> str:
+        with image_scope(), span("odt.document"):
+            styles = render_source(self.render_styles, context)
+            if self.validate_xml:
+                parse_rendered_xml(styles)
+        return styles
+
+    def _stream_content(self, context: dict, members: dict) -> Iterator[bytes]:
+        # Runs while the archive is written, after render_members returned
+        images = {}
+        manifest_entries = []
+        image_writer = self._image_writer(images, manifest_entries)
+
+        with image_scope(), span("odt.document"), span("odt.render") as current:
+            size = 0
+            for chunk in iter_render_images_in_text(self.render_content_stream(context), image_writer):
+                size += len(chunk)
+                yield chunk.encode()
+            current.set_attribute("odt.xml.bytes", size)
+
+        members.update(images)
+        if manifest_entries:
+            members["META-INF/manifest.xml"] = self._manifest_with(manifest_entries)
+
+    def _image_writer(self, images: dict[str, bytes], manifest_entries: list) -> Callable[[Image, str], str]:
+        media_paths = {}
+
+        def image_writer(image: Image, name: str) -> str:
+            # Same as ODTTemplate.add_image, each distinct image is stored once
+            media_path = media_paths.get(image.digest)
+            if media_path is None:
+                media_path = media_paths[image.digest] = get_image_media_path(
+                    image, name, taken=lambda path: path in images or self.template.has_file(path)
+                )
+                images[media_path] = image.data
+                manifest_entries.append((media_path, image.mimetype))
+            return media_path
+
+        return image_writer
+
+    def _manifest_with(self, manifest_entries: list[tuple[str, str]]) -> str:
+        manifest = parse_xml(self.prepared.manifest)
+        for media_path, mimetype in manifest_entries:
+            add_manifest_entry(manifest, media_path, mimetype)
+        return manifest.toxml()
+
+
+def convert_document(document: bytes, format: str = "pdf", converter: LOConverter | None = None) -> bytes:
+    if format == "odt":
+        return document
+    return (converter or libreoffice).convert_bytes(document, format)
+
+
+def render_source(render: Callable[[dict], str], context: dict) -> str:
+    """Run the template engine *render* callable on *context*."""
+    with span("odt.render") as current:
+        rendered = render(context)
+        current.set_attribute("odt.xml.bytes", len(rendered))
+    return rendered
+
+
+def _joined(render: Callable[[dict], Iterable[str]]) -> Callable[[dict], str]:
+    return lambda context: "".join(render(context))
+
+
+def parse_rendered_xml(rendered_xml: str) -> XMLDocument:
+    backend = get_backend()
+    try:
+        with span("odt.parse", {"odt.xml.bytes": len(rendered_xml)}):
+            return parse_xml(rendered_xml.encode("ascii", "xmlcharrefreplace"), backend)
+    except backend.parse_errors as e:
+        lineno, offset = backend.error_position(e)
+        n_context_chars = 38
+        line = rendered_xml.split("\n")[lineno - 1]
+        lower = max(0, offset - n_context_chars)
+        upper = min(offset + n_context_chars, len(line))
+        error_context = line[lower:upper]
+        sep = "-" * (offset - lower) + "^"
+        msg = f"Invalid XML near line {lineno}, column {offset}\n{error_context}\n{sep}"
+        raise InvalidXMLError(msg, lineno, offset) from e
+
+
+def _traced_images(func: Callable) -> Callable:
+    """Run *func* in a span reporting the number of image frames it writes and the size of their images."""
+
+    @wraps(func)
+    def wrapper(xml: XMLDocument | str, image_writer: Callable[[Image, str], str]):
+        with span("odt.images") as current:
+            sizes = {}
+            frames = 0
+
+            def traced_writer(image: Image, name: str) -> str:
+                nonlocal frames
+                frames += 1
+                sizes[image.digest] = len(image.data)
+                return image_writer(image, name)
+
+            result = func(xml, traced_writer)
+            current.set_attribute("odt.images", frames)
+            current.set_attribute("odt.images.bytes", sum(sizes.values()))
+        return result
+
+    return wrapper
+
+
+@_traced_images
+def render_images(xml_document: XMLDocument, image_writer: Callable[[Image, str], str]):
     """
     This function identifies all image frames in the provided XML document and updates their 'href' attributes.
-    The function uses the image's path as the name and employs the ODT file's image writer to save the image and retrieve its path.
+    The frame name, set by the image filter, is either an image file path or a token for an in-memory image.
+    The function employs the ODT file's image writer to save the image and retrieve its path.
     This path is then set as the 'href' attribute for the corresponding image frame in the XML document.
     """
-    frames = xml_document.getElementsByTagName("draw:frame")
+    frames = xml_document.iter("draw:frame")
 
     for frame in frames:
-        if not frame.hasChildNodes():
+        if not len(frame):
             continue
 
-        image = Path(frame.getAttribute("draw:name"))
-
-        if not (image.exists() and image.is_file()):
-            logger.debug("Image file not found", extra={"image": image})
+        resolved = resolve_frame_image(frame.get(qname("draw:name"), ""))
+        if resolved is None:
             continue
 
-        image_node = frame.childNodes[0]
-        media_path = image_writer(image, image.stem)
-        frame.setAttribute("draw:name", image.stem)
-        image_node.setAttribute("xlink:href", media_path)
+        image, name = resolved
+        image_node = frame[0]
+        media_path = image_writer(image, name)
+        frame.set(qname("draw:name"), name)
+        image_node.set(qname("xlink:href"), media_path)
+
 
+_ATTRIBUTE = r"""\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|'[^']*')"""
+_START_TAG_PATTERN = re.compile(rf"<(?![/!?])[^\s/>]+(?:{_ATTRIBUTE})*\s*/?>")
+_ATTRIBUTE_PATTERN = re.compile(r"""([^\s=/>]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
 
-def get_node_parent_of_name(node: Node, name: str) -> Node | str:
+
+@_traced_images
+def render_images_in_text(xml_text: str, image_writer: Callable[[Image, str], str]) -> str:
     """
-    Returns the node's parent with name equal to *name*.
-    Returns None if a parent with that name is not found.
+    `render_images` working on the XML source of a document: only the frames
+    that reference an image, and their image, are rewritten. The rest of the
+    text is copied as is.
+    """
+    draw = _namespace_prefix(xml_text, NAMESPACES["draw"])
+    if draw is None:
+        return xml_text
+    xlink = _namespace_prefix(xml_text, NAMESPACES["xlink"])
+    if xlink is None:
+        # The href attribute would need a namespace declaration
+        document = parse_rendered_xml(xml_text)
+        render_images(document, image_writer)
+        return document.toxml()
+    return _render_frames(xml_text, draw, xlink, image_writer)
+
+
+def iter_render_images_in_text(
+    chunks: Iterable[str], image_writer: Callable[[Image, str], str], buffer_size: int = 64 * 1024
+) -> Iterator[str]:
+    """
+    `render_images_in_text` on the XML source of a document rendered in
+    *chunks*. They are gathered up to *buffer_size* characters and yielded
+    rewritten, only text following an incomplete tag or image frame is held
+    back for the next chunks.
     """
-    if not hasattr(node, "parentNode"):
-        return None
+    # Engines yield small pieces, they are joined without a Python loop over each
+    chunks = _joined_batches(iter(chunks), 1024)
+    pending = []
+    pending_size = 0
+    draw = xlink = None
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < buffer_size:
+            continue
 
-    if node.parentNode.nodeName.lower() == name.lower():
-        return node.parentNode
+        text = "".join(pending)
+        if draw is None:
+            root = _START_TAG_PATTERN.search(text)
+            if root is None:
+                pending = [text]
+                continue
+            draw = _namespace_prefix(root.group(), NAMESPACES["draw"])
+            xlink = _namespace_prefix(root.group(), NAMESPACES["xlink"])
+            if draw is None:
+                # No frames to rewrite
+                yield text
+                yield from chunks
+                return
+            if xlink is None:
+                # Rewriting the frames needs a parse of the whole document
+                yield render_images_in_text("".join([text, *chunks]), image_writer)
+                return
+
+        end = _complete_frames_end(text, draw)
+        yield _render_frames(text[:end], draw, xlink, image_writer)
+        pending = [text[end:]]
+        pending_size = len(text) - end
+
+    text = "".join(pending)
+    if draw is None:
+        yield render_images_in_text(text, image_writer)
+    elif text:
+        yield _render_frames(text, draw, xlink, image_writer)
+
+
+def _joined_batches(chunks: Iterator[str], size: int) -> Iterator[str]:
+    while True:
+        batch = list(islice(chunks, size))
+        if not batch:
+            return
+        yield "".join(batch)
+
+
+def _complete_frames_end(xml_text: str, draw: str) -> int:
+    """Returns where *xml_text* ends before a last tag or image frame that is not complete yet."""
+    end = len(xml_text)
+    last_tag = xml_text.rfind("<")
+    if last_tag != -1 and xml_text.find(">", last_tag) == -1:
+        end = last_tag
+    frame = xml_text.rfind(f"<{draw}:frame", 0, end)
+    if frame != -1:
+        image_node = xml_text.find("<", xml_text.find(">", frame))
+        if image_node == -1 or image_node >= end:
+            end = frame
+    return end
+
+
+def _render_frames(xml_text: str, draw: str, xlink: str, image_writer: Callable[[Image, str], str]) -> str:
+    frame_pattern = re.compile(rf"<{re.escape(draw)}:frame(?:{_ATTRIBUTE})*\s*>")
+    chunks = []
+    position = 0
+    for frame in frame_pattern.finditer(xml_text):
+        if frame.start() < position:
+            continue
+
+        image_node = _START_TAG_PATTERN.match(xml_text, xml_text.find("<", frame.end()))
+        if image_node is None:
+            continue
+
+        attributes = {
+            name: value or single_quoted for name, value, single_quoted in _ATTRIBUTE_PATTERN.findall(frame.group())
+        }
+        name = attributes.get(f"{draw}:name")
+        if not name:
+            continue
+
+        resolved = resolve_frame_image(html.unescape(name))
+        if resolved is None:
+            continue
 
-    # Look into node's grandparent
-    return get_node_parent_of_name(node.parentNode, name)
+        image, name = resolved
+        media_path = image_writer(image, name)
+        chunks.append(xml_text[position : frame.start()])
+        chunks.append(_set_attribute(frame.group(), f"{draw}:name", name))
+        chunks.append(xml_text[frame.end() : image_node.start()])
+        chunks.append(_set_attribute(image_node.group(), f"{xlink}:href", media_path))
+        position = image_node.end()
 
+    chunks.append(xml_text[position:])
+    return "".join(chunks)
 
-def count_node_descendant_tags(node: Node, is_block_tag: bool):
+
+def _namespace_prefix(xml_text: str, uri: str) -> str | None:
+    match = re.search(rf"""xmlns:([^\s=/>]+)\s*=\s*["']{re.escape(uri)}["']""", xml_text)
+    return match.group(1) if match else None
+
+
+def _set_attribute(tag: str, name: str, value: str) -> str:
+    """Set the attribute *name* of the start *tag* to *value*."""
+    value = escape_attribute(value)
+    pattern = re.compile(rf"""(\s{re.escape(name)}\s*=\s*)(?:"[^"]*"|'[^']*')""")
+    tag, count = pattern.subn(lambda match: f'{match.group(1)}"{value}"', tag, count=1)
+    if not count:
+        end = -2 if tag.endswith("/>") else -1
+        tag = f'{tag[:end]} {name}="{value}"{tag[end:]}'
+    return tag
+
+
+def get_node_parent_of_name(document: XMLDocument, node: Element, name: str) -> Element | None:
     """
-    Increment *node* tags_count property and block_count property
-    if *is_block_tag* is True. Otherwise increase *var_count* property.
-    This is also done recursively for this node parents.
+    Returns the node's parent with name equal to *name*.
+    Returns None if a parent with that name is not found.
     """
-    if not node:
-        return
-
-    # start counter
-    for attr in ["tags_count", "block_count", "var_count"]:
-        if not hasattr(node, attr):
-            setattr(node, attr, 0)
-
-    node.tags_count += 1
-    count_var_name = "block_count" if is_block_tag else "var_count"
-    setattr(node, count_var_name, getattr(node, count_var_name) + 1)
-    count_node_descendant_tags(node.parentNode, is_block_tag)
+    name = qname(name)
+    parent = document.parent(node)
+    while parent is not None:
+        if parent.tag == name:
+            return parent
+        # Look into node's grandparent
+        parent = document.parent(parent)
+
+    return None
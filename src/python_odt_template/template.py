@@ -1,158 +1,367 @@
 from __future__ import annotations
 
+import contextlib
+import copy
+import hashlib
 import io
 import os
-import shutil
-import tempfile
+import struct
+import threading
 import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass
 from mimetypes import guess_extension
 from mimetypes import guess_type
 from pathlib import Path
+from typing import Callable
+from typing import Hashable
+from typing import IO
+from typing import Iterable
+from typing import Iterator
 from typing import TYPE_CHECKING
+from typing import Union
 
-from defusedxml.minidom import parseString
 from python_odt_template.markdown_map import transform_map
+from python_odt_template.tracing import span
+from python_odt_template.xmlbackend import parse_xml
+from python_odt_template.xmlbackend import qname
 
 if TYPE_CHECKING:
-    from xml.dom.minidom import Node
+    from python_odt_template.xmlbackend import Element
+    from python_odt_template.xmlbackend import XMLDocument
+
+# Content of an archive member: text, bytes, a file to read or chunks to stream
+Member = Union[str, bytes, Path, Iterable[Union[str, bytes]]]
+
+
+class _XMLPart:
+    """
+    An XML member of the archive, parsed on first access. Writing the member
+    with `ODTTemplate.write_file` drops the parsed document.
+    """
+
+    def __init__(self, member: str):
+        self.member = member
+
+    def __get__(self, template: ODTTemplate | None, owner=None) -> XMLDocument:
+        if template is None:
+            return self
+        document = template.documents.get(self.member)
+        if document is None:
+            with span("odt.parse", {"odt.member": self.member}) as current:
+                data = template.read_bytes(self.member)
+                current.set_attribute("odt.xml.bytes", len(data))
+                document = template.documents[self.member] = parse_xml(data)
+        return document
+
+    def __set__(self, template: ODTTemplate, document: XMLDocument) -> None:
+        template.documents[self.member] = document
 
 
 class ODTTemplate:
-    """An abstraction over an ODT file."""
+    """
+    An abstraction over an ODT file. The archive is kept in memory: members are
+    read lazily from the source zip and only changed or added members are held
+    in `files`. The XML parts are parsed the first time they are accessed.
+    """
+
+    content = _XMLPart("content.xml")
+    styles = _XMLPart("styles.xml")
+    manifest = _XMLPart("META-INF/manifest.xml")
 
-    def __init__(self, file_path: Path | str):
+    def __init__(self, file_path: Path | str | bytes | IO[bytes]):
         self.file_path = file_path
-        self.temp_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.files: dict[str, bytes] = {}
+        self.documents: dict[str, XMLDocument] = {}
+        # Media path of each image added, by content digest
+        self.images: dict[str, str] = {}
         self.unpack()
-        self.content = parseString(self.read_file("content.xml"))
-        self.styles = parseString(self.read_file("styles.xml"))
-        self.manifest = parseString(self.read_file("META-INF/manifest.xml"))
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.temp_dir.cleanup()
+        self.archive.close()
 
-    def write_file(self, name: str, content: str) -> None:
-        with open(self.temp_dir.name + "/" + name, "w") as file:
-            file.write(content)
+    def write_file(self, name: str, content: str | bytes) -> None:
+        self.files[name] = content.encode() if isinstance(content, str) else content
+        self.documents.pop(name, None)
 
     def read_file(self, name: str) -> str:
-        with open(self.temp_dir.name + "/" + name) as file:
-            return file.read()
-
-    def add_image(self, filepath: Path, name: str) -> str:
-        file_type = guess_type(filepath)
-        mimetype = file_type[0] if file_type[0] else ""
-        extension = filepath.suffix if filepath.suffix else guess_extension(mimetype)
-
-        media_path = f"Pictures/{name}{extension}"
-        shutil.copy(filepath, self.temp_dir.name + "/" + media_path)
-
-        manifests = self.manifest.getElementsByTagName("manifest:manifest")[0]
-        media_node = self.manifest.createElement("manifest:file-entry")
-        manifests.appendChild(media_node)
-        media_node.setAttribute("manifest:full-path", media_path)
-        media_node.setAttribute("manifest:media-type", mimetype)
+        return self.read_bytes(name).decode()
+
+    def read_bytes(self, name: str) -> bytes:
+        if name in self.files:
+            return self.files[name]
+        return self.archive.read(name)
+
+    def has_file(self, name: str) -> bool:
+        return name in self.files or name in self.archive.NameToInfo
+
+    def add_image(self, image: Image | Path | str, name: str) -> str:
+        """
+        Add *image*, or the image file at that path, to the archive and returns
+        its media path. An image is stored once however many times it is added.
+        """
+        if not isinstance(image, Image):
+            image = load_image(image)
+        media_path = self.images.get(image.digest)
+        if media_path is None:
+            media_path = self.images[image.digest] = get_image_media_path(image, name, taken=self.has_file)
+            self.files[media_path] = image.data
+            add_manifest_entry(self.manifest, media_path, image.mimetype)
         return media_path
 
     def unpack(self) -> None:
-        with zipfile.ZipFile(self.file_path, "r") as archive:
-            archive.extractall(path=self.temp_dir.name)
-
-    def pack(self, target: str | Path) -> None:
-        zip_file = io.BytesIO()
+        with span("odt.unpack") as current:
+            source = self.file_path
+            if isinstance(source, (str, os.PathLike)):
+                source = Path(source).read_bytes()
+            elif not isinstance(source, (bytes, bytearray, memoryview)):
+                source = source.read()
+            self.source = bytes(source)
+            self.archive = zipfile.ZipFile(io.BytesIO(self.source), "r")
+            current.set_attribute("odt.document.bytes", len(self.source))
+            current.set_attribute("odt.members", len(self.archive.NameToInfo))
+        self.files = {}
+        self.documents = {}
+        self.images = {}
+        self._style_indexes: dict[str, StyleIndex] = {}
+
+    def pack(self, target: str | Path | IO[bytes]) -> None:
+        """
+        Write the archive to *target*, either a file path or any writable
+        binary stream (file object, socket file, HTTP response...). The archive
+        is written member by member and is never fully buffered in memory.
+        """
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as file:
+                self.pack(file)
+            return
 
-        # save any changes made to content.xml, styles.xml and manifest.xml
-        self.write_file("content.xml", self.content.toxml())
-        self.write_file("styles.xml", self.styles.toxml())
-        self.write_file("META-INF/manifest.xml", self.manifest.toxml())
+        self.save()
+        self.write_archive(target)
 
-        with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as zipdoc:
+    def pack_bytes(self) -> bytes:
+        zip_file = io.BytesIO()
+        self.pack(zip_file)
+        return zip_file.getvalue()
+
+    def iter_pack(self) -> Iterator[bytes]:
+        """
+        Yields the archive in chunks as it is produced, suitable for a
+        `StreamingHttpResponse` or a multipart upload.
+        """
+        self.save()
+        stream = _ChunkStream()
+        for _ in self._iter_write_archive(stream):
+            chunk = stream.drain()
+            if chunk:
+                yield chunk
+
+    def save(self) -> None:
+        """Save any changes made to content.xml, styles.xml and manifest.xml"""
+        # Parts that were never parsed are unchanged, or were written as text
+        for name, document in self.documents.items():
+            with span("odt.serialize", {"odt.member": name}) as current:
+                self.files[name] = document.toxml().encode()
+                current.set_attribute("odt.xml.bytes", len(self.files[name]))
+
+    def write_archive(self, file: IO[bytes], overrides: dict[str, Member] | None = None) -> None:
+        """
+        Zip the template into *file*. Members listed in *overrides* are written
+        from the given content (or file path) instead of the template's own,
+        overrides for members that do not exist yet are appended.
+
+        Content given as an iterable of chunks is written as it is produced,
+        before the other members. Consuming it may add members to *overrides*.
+        """
+        with span("odt.pack") as current:
+            for _ in self._iter_write_archive(file, overrides):
+                pass
+            with contextlib.suppress(AttributeError, OSError):
+                current.set_attribute("odt.document.bytes", file.tell())
+
+    def _iter_write_archive(self, file: IO[bytes], overrides: dict[str, Member] | None = None) -> Iterator[None]:
+        # Yields after each member written to file, and once the archive is complete
+        overrides = {} if overrides is None else overrides
+        members = {**self.files, **overrides}
+        streamed = [name for name, content in members.items() if _is_stream(content)]
+
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zipdoc:
             # Add the mimetype file first with no compression
-            mimetype_path = os.path.join(self.temp_dir.name, "mimetype")
-            if os.path.exists(mimetype_path):
-                zipdoc.write(mimetype_path, "mimetype", compress_type=zipfile.ZIP_STORED)
-
-            for root, _, files in os.walk(self.temp_dir.name):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if file_path != mimetype_path:
-                        zipdoc.write(
-                            file_path,
-                            arcname=os.path.relpath(os.path.join(root, file), self.temp_dir.name),
-                        )
-        Path(target).write_bytes(zip_file.getvalue())
-
-    def get_style_node(self, style_name, styles=None):
-        styles = styles or self.get_automatic_styles()
-        if not styles:
-            return None
-
-        for style in styles.childNodes:
-            if hasattr(style, "getAttribute"):
-                if style.getAttribute("style:name") == style_name:
-                    return style
-
-    def get_office_styles(self) -> Node | None:
-        office_styles = self.content.getElementsByTagName("office:styles")
-        if not office_styles:
-            return None
-
-        return office_styles[0]
+            if "mimetype" in members or "mimetype" in self.archive.NameToInfo:
+                self._write_member(zipdoc, "mimetype", members, zipfile.ZIP_STORED)
+                yield
+
+            for name in streamed:
+                self._write_member(zipdoc, name, members)
+                yield
+
+            # Streamed members may have added overrides
+            members = {**self.files, **overrides}
+            names = dict.fromkeys(info.filename for info in self.archive.infolist() if not info.is_dir())
+            names.update(dict.fromkeys(members))
+            for name in ["mimetype", *streamed]:
+                names.pop(name, None)
+
+            for name in names:
+                self._write_member(zipdoc, name, members)
+                yield
+        yield
+
+    def _write_member(
+        self,
+        zipdoc: zipfile.ZipFile,
+        name: str,
+        members: dict[str, Member],
+        compress_type: int | None = None,
+    ) -> None:
+        if name in members:
+            content = members[name]
+            if _is_stream(content):
+                try:
+                    with zipdoc.open(self._member_info(name, compress_type), "w") as entry:
+                        for chunk in content:
+                            entry.write(chunk.encode() if isinstance(chunk, str) else chunk)
+                finally:
+                    # Let a generator left halfway run its cleanup now
+                    if hasattr(content, "close"):
+                        content.close()
+                return
+            content = content.read_bytes() if isinstance(content, Path) else content
+            zipdoc.writestr(self._member_info(name, compress_type), content)
+            return
 
-    def get_automatic_styles(self) -> Node | None:
-        automatic_styles = self.content.getElementsByTagName("office:automatic-styles")
-        if not automatic_styles:
+        # Unchanged members are copied compressed as they are in the source
+        # archive, there is no point inflating and deflating them again.
+        info = self.archive.getinfo(name)
+        if (
+            info.flag_bits & _ENCRYPTED
+            or compress_type not in (None, info.compress_type)
+            or not _copy_raw_member(zipdoc, info, self.source)
+        ):
+            # writestr updates the offsets of the info it is given
+            zipdoc.writestr(copy.copy(info), self.archive.read(info), compress_type)
+
+    def _member_info(self, name: str, compress_type: int | None = None) -> zipfile.ZipInfo:
+        # Members keep the timestamp they have in the template, so the same
+        # template and context always give the same bytes
+        source_info = self.archive.NameToInfo.get(name)
+        info = zipfile.ZipInfo(name, source_info.date_time if source_info else _FIXED_DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED if compress_type is None else compress_type
+        info.external_attr = 0o600 << 16
+        return info
+
+    def style_index(self, part: str = "content.xml") -> StyleIndex:
+        """
+        The index of the styles of *part*, content.xml or styles.xml, built
+        on first use and kept up to date by the insertion methods. Styles added
+        or removed by editing the tree directly are only seen after
+        `reindex_styles`.
+        """
+        document = self.styles if part == "styles.xml" else self.content
+        index = self._style_indexes.get(part)
+        if index is None or index.document is not document:
+            index = self._style_indexes[part] = StyleIndex(document)
+        return index
+
+    def reindex_styles(self) -> None:
+        self._style_indexes.clear()
+
+    def get_style_node(self, style_name: str, styles: Element | None = None, family: str | None = None):
+        """
+        Returns the style named *style_name*, of *family* when given, in the
+        *styles* container, the automatic styles of the content by default.
+        """
+        styles = styles if styles is not None else self.get_automatic_styles()
+        if styles is None:
             return None
 
-        return automatic_styles[0]
+        for part, index in self._style_indexes.items():
+            if index.document is self.documents.get(part) and styles in index.names:
+                return index.get(style_name, family, styles)
+
+        # Not a container of an indexed part
+        for style in styles:
+            if style.get(qname("style:name")) == style_name and family in (None, style.get(qname("style:family"))):
+                return style
+
+    def find_style(self, style_name: str, family: str | None = None) -> Element | None:
+        """Returns the style named *style_name*, of *family* when given, from the content or the styles."""
+        for part in ("content.xml", "styles.xml"):
+            style = self.style_index(part).get(style_name, family)
+            if style is not None:
+                return style
+        return None
+
+    def get_office_styles(self) -> Element | None:
+        # Common styles are in styles.xml, unless the document is a single XML part
+        styles = self.style_index().containers.get("office:styles")
+        if styles is None:
+            styles = self.style_index("styles.xml").containers.get("office:styles")
+        return styles
+
+    def get_automatic_styles(self) -> Element | None:
+        return self.style_index().containers.get("office:automatic-styles")
 
     def insert_style_in_automatic_styles(self, name: str, attrs: dict | None = None, **props):
-        attrs = attrs or {}
-        auto_styles = self.get_automatic_styles()
-        if not auto_styles:
-            return
-
-        style = self.content.createElement("style:style")
-        style.setAttribute("style:name", name)
-        style.setAttribute("style:family", "text")
-        style.setAttribute("style:parent-style-name", "Standard")
-
-        for name, value in attrs.items():
-            style.setAttribute("style:{}".format(name), value)
-
-        if props:
-            style_props = self.content.createElement("style:text-properties")
-            for prop, value in props.items():
-                style_props.setAttribute(prop, value)
-
-            style.appendChild(style_props)
-
-        return auto_styles.appendChild(style)
+        inserted = self.insert_styles(
+            [{"name": name, "attributes": attrs or {}, "properties": props}], skip_existing=False
+        )
+        return inserted[0] if inserted else None
+
+    def insert_styles(self, styles: Iterable[dict], skip_existing: bool = True) -> list[Element]:
+        """
+        Add text *styles* to the automatic styles of the content at once, each
+        given as in `transform_map`: a dict with a "name", and optionally
+        "attributes" of the style:style element and text "properties". Styles
+        whose name is taken are skipped, the styles already there are returned
+        in their place, unless *skip_existing* is false.
+        """
+        index = self.style_index()
+        auto_styles = index.containers.get("office:automatic-styles")
+        if auto_styles is None:
+            return []
+
+        result = []
+        new_styles = []
+        for spec in styles:
+            existing = index.get(spec["name"], container=auto_styles)
+            if existing is not None and skip_existing:
+                result.append(existing)
+                continue
+
+            style = self.content.create_element(
+                "style:style",
+                {"style:name": spec["name"], "style:family": "text", "style:parent-style-name": "Standard"},
+            )
+            for name, value in spec.get("attributes", {}).items():
+                style.set(qname("style:{}".format(name)), value)
+            if spec.get("properties"):
+                style.append(self.content.create_element("style:text-properties", spec["properties"]))
+
+            index.add(auto_styles, style)
+            new_styles.append(style)
+            result.append(style)
+
+        auto_styles.extend(new_styles)
+        return result
 
     def insert_markdown_style(self, include_code: bool = False, transform_map: dict = transform_map):
         if include_code:
             self.insert_markdown_code_style()
 
-        for transform in transform_map.values():
-            if "style" in transform:
-                style_name = transform["style"]["name"]
-                style = self.get_style_node(style_name)
-                if not style:
-                    style = self.insert_style_in_automatic_styles(
-                        style_name, transform["style"].get("attributes", {}), **transform["style"]["properties"]
-                    )
+        self.insert_styles(transform["style"] for transform in transform_map.values() if "style" in transform)
 
     def insert_markdown_code_style(self):
         # Creates a monospace style to use for <code> tags. This new styles
         # inherits from 'Preformatted_20_Text'.
         preformatted = self.get_style_node("Preformatted_20_Text", self.get_office_styles())
-        if not preformatted:
+        if preformatted is None:
             return
 
-        text_props = preformatted.getElementsByTagName("style:text-properties")[0]
+        text_props = next(preformatted.iter(qname("style:text-properties")))
         style_props = {
             "style:font-name": "",
             "fo:font-family": "",
@@ -161,6 +370,265 @@ class ODTTemplate:
         }
 
         for style in style_props.keys():
-            style_props.update(**{style: text_props.getAttribute(style)})
+            style_props.update(**{style: text_props.get(qname(style), "")})
+
+        # Kept when already there, the markdown styles are inserted once per document
+        self.insert_styles([{"name": "markdown_code", "properties": style_props}])
+
+
+# Elements holding the styles of an XML part, children of its root
+STYLE_CONTAINERS = ("office:styles", "office:automatic-styles")
+
+
+class StyleIndex:
+    """
+    The styles of an XML part by container and name, and by family and name,
+    built with a single pass over its style containers. As with a scan of
+    the containers, the first style with a name wins.
+    """
+
+    def __init__(self, document: XMLDocument):
+        self.document = document
+        self.containers: dict[str, Element] = {}
+        self.names: dict[Element, dict[str, Element]] = {}
+        self._families: dict[tuple[str, str], Element] = {}
+
+        containers = {qname(name): name for name in STYLE_CONTAINERS}
+        for child in document.root:
+            name = containers.get(child.tag)
+            if name is None or name in self.containers:
+                continue
+            self.containers[name] = child
+            self.names[child] = {}
+            for style in child:
+                self.add(child, style)
+
+    def __len__(self) -> int:
+        return sum(len(names) for names in self.names.values())
+
+    def get(self, name: str, family: str | None = None, container: Element | None = None) -> Element | None:
+        """Returns the style named *name*, of *family* and in *container* when given."""
+        if container is not None:
+            style = self.names.get(container, {}).get(name)
+            if style is None or family in (None, style.get(qname("style:family"))):
+                return style
+            # Shadowed by a style of another family
+            return next(
+                (s for s in container if s.get(qname("style:name")) == name and s.get(qname("style:family")) == family),
+                None,
+            )
+        if family is not None:
+            return self._families.get((family, name))
+        for names in self.names.values():
+            style = names.get(name)
+            if style is not None:
+                return style
+        return None
+
+    def add(self, container: Element, style: Element) -> None:
+        """Index *style*, which is or will be the last child of *container*."""
+        name = style.get(qname("style:name"))
+        if name is None:
+            return
+        self.names[container].setdefault(name, style)
+        self._families.setdefault((style.get(qname("style:family"), ""), name), style)
 
-        self.insert_style_in_automatic_styles("markdown_code", {}, **style_props)
+
+class _ChunkStream(io.RawIOBase):
+    """A non seekable stream collecting written bytes until drained."""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+_ENCRYPTED = 0x1
+_DATA_DESCRIPTOR = 0x8
+
+
+# Timestamp of members that are not in the template, the earliest a zip can hold
+_FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def _is_stream(content: Member) -> bool:
+    return not isinstance(content, (str, bytes, bytearray, memoryview, Path))
+
+
+def _copy_raw_member(zipdoc: zipfile.ZipFile, info: zipfile.ZipInfo, source: bytes) -> bool:
+    """
+    Copy the member described by *info* from the *source* archive to *zipdoc*
+    without recompressing it. This relies on zipfile internals, False is
+    returned, and nothing written, when they or the member layout are not
+    the expected ones.
+    """
+    try:
+        _write_raw_member(zipdoc, info, _read_raw_member(source, info))
+    except (AttributeError, struct.error, ValueError):
+        return False
+    return True
+
+
+def _read_raw_member(source: bytes, info: zipfile.ZipInfo) -> memoryview:
+    """Returns the compressed bytes of the archive member described by *info*."""
+    header_end = info.header_offset + zipfile.sizeFileHeader
+    header = struct.unpack(zipfile.structFileHeader, source[info.header_offset : header_end])
+    if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        msg = f"No local file header for {info.filename}"
+        raise ValueError(msg)
+    start = header_end + header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH]
+    raw = memoryview(source)[start : start + info.compress_size]
+    if len(raw) != info.compress_size:
+        msg = f"{info.filename} is truncated"
+        raise ValueError(msg)
+    return raw
+
+
+def _write_raw_member(zipdoc: zipfile.ZipFile, info: zipfile.ZipInfo, raw: memoryview) -> None:
+    """Append already compressed *raw* bytes to *zipdoc* as the member described by *info*."""
+    zinfo = copy.copy(info)
+    # Sizes and CRC are known upfront, they go in the local header
+    zinfo.flag_bits &= ~_DATA_DESCRIPTOR
+    header = zinfo.FileHeader()
+    # Everything used below is looked up before anything is written
+    lock, fp, filelist, name_to_info = zipdoc._lock, zipdoc.fp, zipdoc.filelist, zipdoc.NameToInfo
+    if zipdoc._writing:
+        msg = "Another member is being written"
+        raise ValueError(msg)
+    with lock:
+        zinfo.header_offset = fp.tell()
+        fp.write(header)
+        fp.write(raw)
+        zipdoc.start_dir = fp.tell()
+        filelist.append(zinfo)
+        name_to_info[zinfo.filename] = zinfo
+
+
+@dataclass(frozen=True)
+class Image:
+    """The content of an image file, with its digest and media type."""
+
+    data: bytes
+    digest: str
+    mimetype: str
+    extension: str
+
+    @classmethod
+    def from_bytes(cls, data: bytes, mimetype: str | None = None) -> Image:
+        mimetype = mimetype or sniff_image_mimetype(data) or ""
+        return cls(data, hashlib.sha256(data).hexdigest(), mimetype, guess_extension(mimetype) or "")
+
+
+class ImageCache:
+    """Keeps up to *max_size* bytes of images in memory, least recently used first out."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._entries: OrderedDict[Hashable, Image] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Image | None:
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+            return image
+
+    def set(self, key: Hashable, image: Image) -> None:
+        if len(image.data) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.data)
+            self._entries[key] = image
+            self.size += len(image.data)
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+# Image files read by load_image
+image_cache = ImageCache(max_size=64 * 1024 * 1024)
+
+
+def load_image(filepath: Path | str) -> Image:
+    """
+    Read the image at *filepath*. Images are cached process-wide in
+    `image_cache`, a file is read again once it changes on disk.
+    """
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+    image = image_cache.get(key)
+    if image is None:
+        image = _load_image(key[0])
+        image_cache.set(key, image)
+    return image
+
+
+def _load_image(path: str) -> Image:
+    data = Path(path).read_bytes()
+    mimetype = guess_type(path)[0] or sniff_image_mimetype(data) or ""
+    extension = Path(path).suffix or guess_extension(mimetype) or ""
+    return Image(data, hashlib.sha256(data).hexdigest(), mimetype, extension)
+
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+
+def sniff_image_mimetype(data: bytes) -> str | None:
+    """Guess the media type of an image from its first bytes."""
+    for signature, mimetype in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if b"<svg" in data[:1024]:
+        return "image/svg+xml"
+    return None
+
+
+def get_image_media_path(image: Image, name: str, taken: Callable[[str], bool] = lambda media_path: False) -> str:
+    """
+    Returns the path under which *image* is stored in the archive. When that
+    path is *taken* by another member, the image digest is added to the name.
+    """
+    media_path = f"Pictures/{name}{image.extension}"
+    if taken(media_path):
+        media_path = f"Pictures/{name}-{image.digest[:12]}{image.extension}"
+    return media_path
+
+
+def add_manifest_entry(manifest: XMLDocument, media_path: str, mimetype: str) -> None:
+    manifests = manifest.find("manifest:manifest")
+    media_node = manifest.create_element(
+        "manifest:file-entry", {"manifest:full-path": media_path, "manifest:media-type": mimetype}
+    )
+    manifests.append(media_node)
@@ -0,0 +1,99 @@
+"""
+Instrumentation of the rendering pipeline. Each stage (unpack, parse,
+prepare, render, images, pack, convert) runs in a span reporting its
+duration and sizes to the registered hooks, and to an OpenTelemetry tracer
+when one is set. With neither, spans cost next to nothing.
+
+    from python_odt_template import tracing
+
+    tracing.add_hook(lambda name, seconds, attributes: print(name, seconds, attributes))
+    tracing.set_tracer(opentelemetry.trace.get_tracer("python_odt_template"))
+"""
+
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import Protocol
+
+__all__ = ("Span", "add_hook", "remove_hook", "set_tracer", "span")
+
+Hook = Callable[[str, float, dict], None]
+
+
+class Tracer(Protocol):
+    """The part of the OpenTelemetry tracer API used here."""
+
+    def start_as_current_span(self, name: str, attributes: dict | None = None) -> contextlib.AbstractContextManager: ...
+
+
+class Span:
+    """Collects the attributes of a stage, see `span`."""
+
+    __slots__ = ("_otel_span", "attributes", "name")
+
+    def __init__(self, name: str, attributes: dict, otel_span: Any = None):
+        self.name = name
+        self.attributes = attributes
+        self._otel_span = otel_span
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_hooks: list[Hook] = []
+_tracer: Tracer | None = None
+
+
+def add_hook(hook: Hook) -> None:
+    """Call *hook* with the name, duration in seconds and attributes of every span that ends."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    _hooks.remove(hook)
+
+
+def set_tracer(tracer: Tracer | None) -> None:
+    """Report spans to *tracer*, e.g. an OpenTelemetry tracer, or stop reporting them with None."""
+    global _tracer
+    _tracer = tracer
+
+
+@contextlib.contextmanager
+def span(name: str, attributes: dict | None = None) -> Iterator[Span | _NoopSpan]:
+    """Run a stage named *name*, more attributes can be set on the yielded span."""
+    hooks, tracer = _hooks, _tracer
+    if not hooks and tracer is None:
+        yield _NOOP_SPAN
+        return
+
+    attributes = dict(attributes or {})
+    with contextlib.ExitStack() as stack:
+        otel_span = None
+        if tracer is not None:
+            otel_span = stack.enter_context(tracer.start_as_current_span(name, attributes=dict(attributes)))
+        current = Span(name, attributes, otel_span)
+        start = time.perf_counter()
+        try:
+            yield current
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            for hook in list(hooks):
+                hook(name, seconds, current.attributes)
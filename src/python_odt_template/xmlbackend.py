@@ -0,0 +1,425 @@
+"""
+XML backends used to parse, edit and serialize the XML parts of a document.
+
+Documents are manipulated through the ElementTree API (tags and attributes in
+"{namespace}name" notation, text and tail strings), which lxml and the
+standard library's ElementTree both implement. lxml is used when installed,
+ElementTree otherwise. Both backends refuse DTDs, entities and external
+references, the same guarantees defusedxml gives, and both serialize a part
+with the namespace prefixes it was parsed with.
+"""
+
+from __future__ import annotations
+
+import abc
+import copy
+import io
+from functools import lru_cache
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from xml.etree import ElementTree
+
+from defusedxml import DTDForbidden
+from defusedxml.ElementTree import iterparse
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # no cov
+    lxml_etree = None
+
+NAMESPACES = {
+    "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    "style": "urn:oasis:names:tc:opendocument:xmlns:style:1.0",
+    "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+    "table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+    "draw": "urn:oasis:names:tc:opendocument:xmlns:drawing:1.0",
+    "fo": "urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0",
+    "svg": "urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0",
+    "xlink": "http://www.w3.org/1999/xlink",
+    "manifest": "urn:oasis:names:tc:opendocument:xmlns:manifest:1.0",
+    "xml": "http://www.w3.org/XML/1998/namespace",
+}
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+Element = Any
+
+
+@lru_cache(maxsize=None)
+def qname(name: str) -> str:
+    """Returns the "{namespace}name" notation of a prefixed ODF name such as "text:p"."""
+    prefix, sep, local = name.partition(":")
+    if not sep or prefix not in NAMESPACES:
+        return name
+    return f"{{{NAMESPACES[prefix]}}}{local}"
+
+
+class XMLDocument(abc.ABC):
+    """A parsed XML part, wrapping the root element of its tree."""
+
+    def __init__(self, root: Element):
+        self.root = root
+
+    def iter(self, name: str) -> Iterator[Element]:
+        """Iterate over the elements named *name* (e.g. "text:p") in document order."""
+        return self.root.iter(qname(name))
+
+    def find(self, name: str) -> Element | None:
+        return next(self.iter(name), None)
+
+    def create_element(self, name: str, attrib: dict[str, str] | None = None, text: str | None = None) -> Element:
+        element = self.root.makeelement(qname(name), {qname(k): v for k, v in (attrib or {}).items()})
+        element.text = text
+        return element
+
+    @abc.abstractmethod
+    def parent(self, element: Element) -> Element | None: ...
+
+    @abc.abstractmethod
+    def toxml(self) -> str: ...
+
+    def index(self, parent: Element, element: Element) -> int:
+        return list(parent).index(element)
+
+    def insert_before(self, element: Element, new: Element) -> None:
+        parent = self.parent(element)
+        parent.insert(self.index(parent, element), new)
+        self._set_parent(new, parent)
+
+    def insert_text_before(self, element: Element, text: str) -> None:
+        parent = self.parent(element)
+        index = self.index(parent, element)
+        if index == 0:
+            parent.text = (parent.text or "") + text
+        else:
+            previous = parent[index - 1]
+            previous.tail = (previous.tail or "") + text
+
+    def insert_text_after(self, element: Element, text: str) -> None:
+        element.tail = text + (element.tail or "")
+
+    def remove(self, element: Element) -> None:
+        """Remove *element* and its children, its tail text is kept in place."""
+        if element.tail:
+            self.insert_text_before(element, element.tail)
+            element.tail = None
+        self.parent(element).remove(element)
+        self._set_parent(element, None)
+
+    def replace(self, element: Element, new: Element) -> None:
+        """Replace *element* by *new*, which may come from another document."""
+        parent = self.parent(element)
+        new.tail = element.tail
+        parent[self.index(parent, element)] = new
+        self._set_parent(element, None)
+        self._set_parent(new, parent)
+
+    def set_children(self, parent: Element, children: list[Element]) -> None:
+        """Replace the children of *parent* by *children*, tails are left to the caller."""
+        parent[:] = children
+
+    def _set_parent(self, element: Element, parent: Element | None) -> None:
+        pass
+
+
+class TreeEdits:
+    """
+    Records insertions and removals around elements of *document* and applies
+    them at once with `apply`, rebuilding each edited parent a single time.
+    The result is the same as calling the `XMLDocument` methods of the same
+    name in order, whose cost grows with the number of siblings.
+    """
+
+    def __init__(self, document: XMLDocument):
+        self.document = document
+        self.parents: dict[Element, None] = {}
+        self.before: dict[Element, list[str | Element]] = {}
+        self.after: dict[Element, list[str]] = {}
+        self.removed: set[Element] = set()
+
+    def _edit(self, element: Element) -> None:
+        parent = self.document.parent(element)
+        if parent is None:
+            raise ValueError(f"Cannot edit around the root element {element.tag}")
+        self.parents[parent] = None
+
+    def insert_before(self, element: Element, new: Element) -> None:
+        self._edit(element)
+        self.before.setdefault(element, []).append(new)
+
+    def insert_text_before(self, element: Element, text: str) -> None:
+        self._edit(element)
+        self.before.setdefault(element, []).append(text)
+
+    def insert_text_after(self, element: Element, text: str) -> None:
+        self._edit(element)
+        self.after.setdefault(element, []).insert(0, text)
+
+    def remove(self, element: Element) -> None:
+        """Remove *element* and its children, its tail text is kept in place."""
+        self._edit(element)
+        self.removed.add(element)
+
+    def apply(self) -> None:
+        for parent in self.parents:
+            # The parent's content as a flat sequence of texts and elements
+            items = [parent.text]
+            for child in parent:
+                items.extend(self.before.get(child, ()))
+                if child not in self.removed:
+                    items.append(child)
+                items.extend(self.after.get(child, ()))
+                items.append(child.tail)
+
+            children = []
+            texts = {}
+            previous = parent
+            for item in items:
+                if item is None:
+                    continue
+                if isinstance(item, str):
+                    texts.setdefault(previous, []).append(item)
+                else:
+                    children.append(item)
+                    previous = item
+
+            for child in parent:
+                if child in self.removed:
+                    self.document._set_parent(child, None)
+            self.document.set_children(parent, children)
+            parent.text = "".join(texts[parent]) if parent in texts else None
+            for child in children:
+                child.tail = "".join(texts[child]) if child in texts else None
+                self.document._set_parent(child, parent)
+
+        self.parents.clear()
+        self.before.clear()
+        self.after.clear()
+        self.removed.clear()
+
+
+class XMLBackend(abc.ABC):
+    name: str
+
+    # Exceptions raised by parse on malformed XML, they have a (line, column) position
+    parse_errors: tuple[type[Exception], ...]
+
+    @abc.abstractmethod
+    def parse(self, data: bytes) -> XMLDocument: ...
+
+    def error_position(self, error: Exception) -> tuple[int, int]:
+        """The line, from 1, and column, from 0 as expat reports it, of a parse error."""
+        return error.position
+
+
+class LxmlDocument(XMLDocument):
+    def parent(self, element: Element) -> Element | None:
+        return element.getparent()
+
+    def index(self, parent: Element, element: Element) -> int:
+        return parent.index(element)
+
+    def replace(self, element: Element, new: Element) -> None:
+        if new.getroottree().getroot() is not self.root:
+            # Moving an element out of another document reconciles namespaces
+            # declared above it node by node, which is quadratic in lxml. A
+            # copy declares them on its root and is moved in linear time.
+            new = copy.deepcopy(new)
+        super().replace(element, new)
+
+    def set_children(self, parent: Element, children: list[Element]) -> None:
+        # Slice assignment moves every child, which gets slow on large
+        # documents. Only the removed and added children are touched.
+        kept = set(children)
+        for child in list(parent):
+            if child not in kept:
+                parent.remove(child)
+
+        previous = None
+        for child in children:
+            if child.getparent() is not parent:
+                if previous is None:
+                    parent.insert(0, child)
+                else:
+                    previous.addnext(child)
+            previous = child
+
+    def toxml(self) -> str:
+        return XML_DECLARATION + lxml_etree.tostring(self.root, encoding="unicode")
+
+
+class LxmlBackend(XMLBackend):
+    name = "lxml"
+
+    def __init__(self):
+        self.parser = lxml_etree.XMLParser(
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+            huge_tree=True,
+            # Rendered loops may repeat xml:id values, which LibreOffice tolerates
+            collect_ids=False,
+        )
+        self.parse_errors = (lxml_etree.XMLSyntaxError,)
+
+    def parse(self, data: bytes) -> XMLDocument:
+        root = lxml_etree.fromstring(data, self.parser)
+        docinfo = root.getroottree().docinfo
+        if docinfo.doctype:
+            raise DTDForbidden(docinfo.root_name, docinfo.system_url, docinfo.public_id)
+        return LxmlDocument(root)
+
+    def error_position(self, error: Exception) -> tuple[int, int]:
+        # libxml2 columns start at 1
+        lineno, offset = error.position
+        return lineno, max(0, offset - 1)
+
+
+class ElementTreeDocument(XMLDocument):
+    def __init__(self, root: Element, namespaces: list[tuple[str, str]]):
+        super().__init__(root)
+        # Every declaration is kept, attribute values such as formulas may
+        # reference a prefix without any element using it.
+        self.namespaces = namespaces
+        self._parents: dict[Element, Element] | None = None
+
+    def parent(self, element: Element) -> Element | None:
+        if self._parents is None:
+            self._parents = {child: parent for parent in self.root.iter() for child in parent}
+        return self._parents.get(element)
+
+    def _set_parent(self, element: Element, parent: Element | None) -> None:
+        if self._parents is None:
+            return
+        if parent is None:
+            self._parents.pop(element, None)
+        elif self._parents.get(element) is not parent:
+            self._parents[element] = parent
+            self._parents.update((child, node) for node in element.iter() for child in node)
+
+    def toxml(self) -> str:
+        chunks = [XML_DECLARATION]
+        tostring(self.root, chunks.append, namespaces=self.namespaces)
+        return "".join(chunks)
+
+
+class ElementTreeBackend(XMLBackend):
+    name = "etree"
+    parse_errors = (ElementTree.ParseError,)
+
+    def parse(self, data: bytes) -> XMLDocument:
+        events = iterparse(io.BytesIO(data), events=("start-ns",), forbid_dtd=True)
+        namespaces = [namespace for _, namespace in events]
+        return ElementTreeDocument(events.root, namespaces)
+
+
+BACKENDS: dict[str, type[XMLBackend]] = {"etree": ElementTreeBackend}
+if lxml_etree is not None:
+    BACKENDS["lxml"] = LxmlBackend
+
+_default_backend: XMLBackend = BACKENDS["lxml" if "lxml" in BACKENDS else "etree"]()
+
+
+def get_backend(name: str | None = None) -> XMLBackend:
+    if name is None:
+        return _default_backend
+    return BACKENDS[name]()
+
+
+def set_default_backend(name: str) -> None:
+    """Select the backend used to parse documents, "lxml" or "etree"."""
+    global _default_backend
+    _default_backend = get_backend(name)
+
+
+def parse_xml(data: bytes | str, backend: XMLBackend | None = None) -> XMLDocument:
+    if isinstance(data, str):
+        data = data.encode()
+    return (backend or _default_backend).parse(data)
+
+
+def escape_text(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def escape_attribute(value: str) -> str:
+    value = escape_text(value)
+    if '"' in value:
+        value = value.replace('"', "&quot;")
+    for char, entity in (("\n", "&#10;"), ("\r", "&#13;"), ("\t", "&#09;")):
+        if char in value:
+            value = value.replace(char, entity)
+    return value
+
+
+def tostring(
+    element: Element,
+    write: Callable[[str], Any],
+    namespaces: list[tuple[str, str]] | None = None,
+    with_tail: bool = False,
+) -> None:
+    """
+    Serialize an ElementTree *element* through *write*. Namespaced names use
+    the prefixes of *namespaces*, declared on *element*. Names that are not
+    namespaced, such as "text:span" in markdown fragments, are written as is.
+    """
+    prefixes = {"http://www.w3.org/XML/1998/namespace": "xml"}
+    declarations = ""
+    for prefix, uri in namespaces or ():
+        if uri not in prefixes:
+            prefixes[uri] = prefix
+            declarations += f' xmlns:{prefix}="{escape_attribute(uri)}"' if prefix else f' xmlns="{uri}"'
+    _write_element(element, write, prefixes, declarations)
+    if with_tail and element.tail:
+        write(escape_text(element.tail))
+
+
+def _write_element(element: Element, write: Callable[[str], Any], prefixes: dict[str, str], declarations: str) -> None:
+    def name(qualified: str) -> str:
+        nonlocal prefixes, declarations
+        if qualified[:1] != "{":
+            return qualified
+        uri, local = qualified[1:].split("}", 1)
+        if uri not in prefixes:
+            # Namespace unknown to the source document, declared in scope
+            prefixes = {**prefixes, uri: f"ns{len(prefixes)}"}
+            declarations += f' xmlns:{prefixes[uri]}="{escape_attribute(uri)}"'
+        prefix = prefixes[uri]
+        return f"{prefix}:{local}" if prefix else local
+
+    # Iterative, documents may be deeper than the recursion limit. The stack
+    # holds elements to write along with their namespaces, or text to write.
+    stack: list[tuple[Element, dict[str, str], str] | str] = [(element, prefixes, declarations)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            write(item)
+            continue
+
+        element, prefixes, declarations = item
+        tag = element.tag
+        if not isinstance(tag, str):
+            # Comments and processing instructions are not part of ODF parts
+            continue
+
+        tag = name(tag)
+        attributes = "".join(f' {name(key)}="{escape_attribute(value)}"' for key, value in element.items())
+        write(f"<{tag}{declarations}{attributes}")
+        if element.text or len(element):
+            write(">")
+            if element.text:
+                write(escape_text(element.text))
+            stack.append(f"</{tag}>")
+            for child in reversed(element):
+                if child.tail:
+                    stack.append(escape_text(child.tail))
+                stack.append((child, prefixes, ""))
+        else:
+            write("/>")
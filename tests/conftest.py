@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import io
+import zipfile
+
+import pytest
+
+NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+    'xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'office:version="1.2"'
+)
+
+MANIFEST = (
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.text"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>'
+    "</manifest:manifest>"
+)
+
+
+def make_odt(body: str, automatic_styles: str = "", styles: str = "") -> bytes:
+    """
+    An ODT archive with *body* as its office:text content, *automatic_styles*
+    in the content and *styles* as the common styles.
+    """
+    content = (
+        f"<office:document-content {NAMESPACES}><office:automatic-styles>{automatic_styles}</office:automatic-styles>"
+        f"<office:body><office:text>{body}</office:text></office:body></office:document-content>"
+    )
+    styles = f"<office:document-styles {NAMESPACES}><office:styles>{styles}</office:styles></office:document-styles>"
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/vnd.oasis.opendocument.text", zipfile.ZIP_STORED)
+        archive.writestr("content.xml", content)
+        archive.writestr("styles.xml", styles)
+        archive.writestr("META-INF/manifest.xml", MANIFEST)
+        archive.writestr("Thumbnails/thumbnail.png", b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 8)
+    return output.getvalue()
+
+
+@pytest.fixture
+def field_template() -> bytes:
+    """A template with a paragraph holding the field {{ value }}."""
+    return make_odt("<text:p><text:text-input>{{ value }}</text:text-input></text:p>")
+
+
+@pytest.fixture
+def odt_factory():
+    """`make_odt`, for tests building templates of their own."""
+    return make_odt
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+from python_odt_template.aio import AsyncLimitMixin
+
+
+class Limited(AsyncLimitMixin):
+    max_concurrency = 1
+
+    def __init__(self):
+        self.running = 0
+        self.most_running = 0
+
+    async def work(self):
+        async with self.async_limiter:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            await asyncio.sleep(0.01)
+            self.running -= 1
+
+
+def test_limiter_limits_concurrent_calls():
+    limited = Limited()
+
+    async def main():
+        await asyncio.gather(*(limited.work() for _ in range(5)))
+
+    asyncio.run(main())
+    assert limited.most_running == 1
+
+
+def test_limiter_works_across_event_loops():
+    # Module level objects, e.g. the default converters, outlive asyncio.run()
+    limited = Limited()
+
+    async def main():
+        await asyncio.gather(limited.work(), limited.work(), limited.work())
+
+    asyncio.run(main())
+    asyncio.run(main())
+    assert limited.most_running == 1
+
+
+class Blocking(AsyncLimitMixin):
+    max_concurrency = 1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.finished = 0
+
+    def work(self, seconds: float):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(seconds)
+        with self.lock:
+            self.running -= 1
+            self.finished += 1
+        return seconds
+
+
+def test_timed_out_call_keeps_its_slot_until_it_finishes():
+    blocking = Blocking()
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await blocking.run_limited(blocking.work, 0.3, timeout=0.05)
+        # The first call still runs in its thread, this one waits for it
+        assert await blocking.run_limited(blocking.work, 0.01) == 0.01
+
+    asyncio.run(main())
+    assert blocking.finished == 2
+    assert blocking.most_running == 1
+
+
+def test_cancelled_calls_do_not_pile_up_threads():
+    blocking = Blocking()
+
+    async def main():
+        tasks = [asyncio.ensure_future(blocking.run_limited(blocking.work, 0.05)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Only the call that had a slot was started
+        await blocking.run_limited(blocking.work, 0)
+
+    asyncio.run(main())
+    assert blocking.most_running == 1
+    assert blocking.finished == 2
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import io
+import os
+import zipfile
+from functools import partial
+
+from jinja2 import Environment
+from python_odt_template.batch import render_many
+from python_odt_template.jinja import get_odt_renderer
+from python_odt_template.renderer import ODTRenderer
+
+
+def exit_on_kill(value):
+    # Kills the worker rendering the value "kill", as if it ran out of memory
+    if value == "kill":
+        os._exit(1)
+    return value
+
+
+def killing_renderer() -> ODTRenderer:
+    return get_odt_renderer(".", env=Environment(finalize=exit_on_kill))
+
+
+def rendered_text(document: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(document)) as archive:
+        return archive.read("content.xml").decode()
+
+
+def test_render_many_in_pool(field_template):
+    contexts = [{"value": f"value {index}"} for index in range(6)]
+    results = sorted(
+        render_many(field_template, contexts, None, partial(get_odt_renderer, "."), workers=2),
+        key=lambda result: result.index,
+    )
+
+    assert [result.index for result in results] == list(range(6))
+    for index, result in enumerate(results):
+        assert result.ok
+        assert f"value {index}" in rendered_text(result.output)
+
+
+def test_dead_worker_does_not_stop_other_contexts(field_template):
+    contexts = [{"value": f"value {index}"} for index in range(40)]
+    contexts[3] = {"value": "kill"}
+    results = {
+        result.index: result for result in render_many(field_template, contexts, None, killing_renderer, workers=2)
+    }
+
+    assert sorted(results) == list(range(40))
+    assert not results[3].ok
+    # Contexts in flight when the worker died fail with it, a new pool renders the following ones
+    for index in range(20, 40):
+        assert results[index].ok
+        assert f"value {index}" in rendered_text(results[index].output)
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import io
+import zipfile
+from dataclasses import dataclass
+from dataclasses import field
+
+import pytest
+from python_odt_template.cache import CachingConverter
+from python_odt_template.cache import DirectoryStore
+from python_odt_template.cache import document_digest
+from python_odt_template.cache import MemoryStore
+from python_odt_template.cache import TemplateCache
+from python_odt_template.jinja import get_odt_renderer
+from python_odt_template.libreoffice import InMemoryConverterMixin
+from python_odt_template.libreoffice import LOConverter
+
+
+@pytest.fixture
+def write_template(odt_factory):
+    def write(path, text: str):
+        path.write_bytes(odt_factory(f"<text:p>{text} {{{{ value }}}}</text:p>"))
+        return path
+
+    return write
+
+
+@pytest.fixture
+def templates(tmp_path, write_template):
+    return [write_template(tmp_path / f"{index}.odt", f"Template {index}") for index in range(3)]
+
+
+def test_template_cache_evicts_least_recently_used_by_count(templates):
+    cache = TemplateCache(get_odt_renderer("."), max_entries=2)
+    first, second, third = templates
+    cache.get(first)
+    cache.get(second)
+    cache.get(first)
+    cache.get(third)
+
+    assert first in cache
+    assert second not in cache
+    assert third in cache
+    assert cache.stats.evictions == 1
+
+
+def test_template_cache_evicts_least_recently_used_by_size(templates):
+    cache = TemplateCache(get_odt_renderer("."))
+    first, second, third = templates
+    cache.get(first)
+    # Room for two templates of about the same size
+    cache.max_size = cache.size * 2 + cache.size // 2
+
+    cache.get(second)
+    cache.get(third)
+    assert first not in cache
+    assert len(cache) == 2
+    assert cache.size <= cache.max_size
+
+
+def test_template_cache_invalidation(templates, write_template):
+    cache = TemplateCache(get_odt_renderer("."))
+    path = templates[0]
+    compiled = cache.get(path)
+
+    # Touched but not modified: the compiled template is kept
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.get(path) is compiled
+    assert cache.stats.invalidations == 0
+
+    write_template(path, "Changed")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000))
+    changed = cache.get(path)
+    assert changed is not compiled
+    assert "Changed" in changed.prepared.content
+    assert cache.stats.invalidations == 1
+
+
+def test_template_cache_stats(templates):
+    cache = TemplateCache(get_odt_renderer("."))
+    assert cache.stats.hit_ratio == 0.0
+
+    cache.get(templates[0])
+    cache.get(templates[0])
+    cache.get(templates[0])
+    cache.get(templates[1])
+
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.evictions, stats.invalidations) == (2, 2, 0, 0)
+    assert stats.entries == 2
+    assert stats.size == cache.size > 0
+    assert stats.hit_ratio == 0.5
+
+    cache.invalidate(templates[0])
+    assert cache.stats.entries == 1
+    cache.invalidate()
+    assert (cache.stats.entries, cache.stats.size) == (0, 0)
+
+
+def test_template_cache_compiles_once_for_concurrent_misses(templates):
+    renderer = get_odt_renderer(".")
+    compiles = []
+    compile = renderer.compile
+
+    def slow_compile(source):
+        compiles.append(source)
+        time.sleep(0.05)
+        return compile(source)
+
+    renderer.compile = slow_compile
+    cache = TemplateCache(renderer)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(templates[0]))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(compiles) == 1
+    assert len({id(result) for result in results}) == 1
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.invalidations) == (3, 1, 0)
+
+
+@dataclass
+class CountingConverter(InMemoryConverterMixin, LOConverter):
+    raise_on_error: bool = True
+    exec_bin: str = "fake"
+    calls: list = field(default_factory=list)
+
+    def convert_bytes(self, data: bytes, to: str = "pdf", filtername: str | None = None) -> bytes:
+        self.calls.append((to, filtername))
+        return f"{to}:{filtername}:".encode() + data
+
+
+def recompressed(document: bytes) -> bytes:
+    """*document* with its members stored uncompressed and timestamped differently."""
+    output = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(document)) as source, zipfile.ZipFile(output, "w") as archive:
+        for info in source.infolist():
+            archive.writestr(zipfile.ZipInfo(info.filename, (2001, 2, 3, 4, 5, 6)), source.read(info))
+    return output.getvalue()
+
+
+def test_caching_converter_hit_skips_the_converter(field_template, tmp_path):
+    converter = CountingConverter()
+    caching = CachingConverter(converter)
+
+    converted = caching.convert_bytes(field_template)
+    assert caching.convert_bytes(field_template) == converted
+    # Same members, another archive layout
+    assert caching.convert_bytes(recompressed(field_template)) == converted
+    assert converter.calls == [("pdf", None)]
+    assert (caching.hits, caching.misses) == (2, 1)
+    assert caching.stats.entries == 1
+
+    input_file = tmp_path / "document.odt"
+    input_file.write_bytes(field_template)
+    caching.convert(input_file, tmp_path)
+    assert (tmp_path / "document.pdf").read_bytes() == converted
+    assert len(converter.calls) == 1
+
+
+def test_cache_key_depends_on_format_filter_and_options(field_template):
+    caching = CachingConverter(CountingConverter())
+    keys = {
+        caching.cache_key(field_template, "pdf"),
+        caching.cache_key(field_template, "docx"),
+        caching.cache_key(field_template, "pdf", "writer_pdf_Export"),
+        CachingConverter(CountingConverter(), options="LibreOffice 7.6").cache_key(field_template, "pdf"),
+    }
+    assert len(keys) == 4
+    assert document_digest(field_template) == document_digest(recompressed(field_template))
+
+
+def test_directory_store_round_trip(tmp_path):
+    store = DirectoryStore(tmp_path / "store")
+    assert store.get("key") is None
+    store.set("key", b"converted")
+    assert store.get("key") == b"converted"
+
+    # Another process sharing the directory
+    other = DirectoryStore(tmp_path / "store")
+    assert other.get("key") == b"converted"
+    assert len(other) == 1
+    assert other.size == store.size
+
+
+@pytest.mark.parametrize("damage", [lambda data: data[:-5], lambda data: b"x" + data[1:], lambda data: b""])
+def test_corrupted_store_file_is_a_miss(tmp_path, field_template, damage):
+    store = DirectoryStore(tmp_path / "store")
+    converter = CountingConverter()
+    caching = CachingConverter(converter, store)
+    converted = caching.convert_bytes(field_template)
+
+    (path,) = (tmp_path / "store").glob("*.bin")
+    path.write_bytes(damage(path.read_bytes()))
+    assert store.get(path.stem) is None
+    assert not path.exists()
+
+    assert caching.convert_bytes(field_template) == converted
+    assert len(converter.calls) == 2
+    assert caching.convert_bytes(field_template) == converted
+    assert len(converter.calls) == 2
+
+
+def test_memory_store_is_bounded():
+    store = MemoryStore(max_entries=2, max_size=10)
+    store.set("a", b"aaaa")
+    store.set("b", b"bbbb")
+    store.set("c", b"cccc")
+    assert store.get("a") is None
+    assert store.size == 8
+    store.set("d", b"d" * 11)
+    assert store.get("d") is None
+    assert store.evictions == 1
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from python_odt_template.images import clear_image_caches
+from python_odt_template.template import Image
+from python_odt_template.template import image_cache
+from python_odt_template.template import ImageCache
+from python_odt_template.template import load_image
+
+
+def test_image_cache_is_bounded_by_size():
+    cache = ImageCache(max_size=10)
+    cache.set("a", Image.from_bytes(b"aaaa"))
+    cache.set("b", Image.from_bytes(b"bbbb"))
+    assert cache.get("a") is not None
+    cache.set("c", Image.from_bytes(b"cccc"))
+
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size == 8
+
+    cache.set("d", Image.from_bytes(b"d" * 11))
+    assert cache.get("d") is None
+    assert len(cache) == 2
+
+
+def test_load_image_is_cached_until_cleared(tmp_path):
+    path = tmp_path / "logo.png"
+    path.write_bytes(b"\x89PNG\r\n\x1a\nlogo")
+
+    image = load_image(path)
+    assert image.mimetype == "image/png"
+    assert load_image(path) is image
+    assert image_cache.size >= len(image.data)
+
+    clear_image_caches()
+    assert len(image_cache) == 0
+    assert load_image(path) is not image
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
+from python_odt_template.jinja import get_odt_renderer
+
+
+def make_renderer(tmp_path):
+    env = Environment(bytecode_cache=FileSystemBytecodeCache(str(tmp_path / "bytecode")))
+    return env, get_odt_renderer(tmp_path, env=env)
+
+
+def test_compiled_sources_get_their_own_bytecode(tmp_path):
+    (tmp_path / "bytecode").mkdir()
+    _, renderer = make_renderer(tmp_path)
+    assert renderer.compile_source("Hello {{ name }}")({"name": "Ada"}) == "Hello Ada"
+    assert renderer.compile_source("Bye {{ name }}")({"name": "Ada"}) == "Bye Ada"
+
+    assert len(list((tmp_path / "bytecode").glob("*.cache"))) == 2
+
+
+def test_compile_in_fresh_environment_loads_cached_bytecode(tmp_path, monkeypatch):
+    (tmp_path / "bytecode").mkdir()
+    _, renderer = make_renderer(tmp_path)
+    renderer.compile_source("Hello {{ name }}")
+    renderer.compile_source("Bye {{ name }}")
+
+    # Another process: a new environment reading the same cache directory
+    env, renderer = make_renderer(tmp_path)
+
+    def compile(*args, **kwargs):
+        raise AssertionError("Template compiled again")
+
+    monkeypatch.setattr(env, "compile", compile)
+    assert renderer.compile_source("Hello {{ name }}")({"name": "Ada"}) == "Hello Ada"
+    assert renderer.compile_source("Bye {{ name }}")({"name": "Ada"}) == "Bye Ada"
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import socket
+import sys
+import threading
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from xmlrpc.server import SimpleXMLRPCServer
+
+import pytest
+from python_odt_template.libreoffice import LibreOffice
+from python_odt_template.libreoffice import LibreOfficeError
+from python_odt_template.libreoffice import LibreOfficePool
+from python_odt_template.libreoffice import UnoClientConverter
+
+FAKE_SOFFICE = """\
+import sys
+from pathlib import Path
+
+args = sys.argv[1:]
+output_dir = Path(args[args.index("--outdir") + 1])
+sys.stderr.write("warn: failed to launch javaldx\\n")
+for input_file in map(Path, args[args.index("--outdir") + 2 :]):
+    if "broken" not in input_file.name:
+        (output_dir / f"{input_file.stem}.pdf").write_bytes(input_file.read_bytes())
+"""
+
+
+def fake_libreoffice(tmp_path, **kwargs) -> LibreOffice:
+    script = tmp_path / "soffice"
+    script.write_text(f"#!{sys.executable}\n{FAKE_SOFFICE}")
+    script.chmod(0o755)
+    libreoffice = LibreOffice(**kwargs)
+    libreoffice.exec_bin = str(script)
+    return libreoffice
+
+
+def test_convert_many_reports_output_collisions(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = tmp_path / "a" / "report.odt"
+    second = tmp_path / "b" / "report.odt"
+    other = tmp_path / "a" / "other.odt"
+    first.write_bytes(b"first")
+    second.write_bytes(b"second")
+    other.write_bytes(b"other")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+
+    results = fake_libreoffice(tmp_path).convert_many([first, second, other], output_dir)
+
+    assert [result.input_file for result in results] == [first, second, other]
+    assert results[0].ok and results[2].ok
+    assert not results[1].ok
+    assert "report.pdf" in str(results[1].error)
+    assert (output_dir / "report.pdf").read_bytes() == b"first"
+
+
+def test_convert_many_logs_stderr_only_on_failure(tmp_path, caplog):
+    good = tmp_path / "good.odt"
+    broken = tmp_path / "broken.odt"
+    good.write_bytes(b"good")
+    broken.write_bytes(b"broken")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    libreoffice = fake_libreoffice(tmp_path)
+
+    with caplog.at_level(logging.ERROR, logger="python_odt_template"):
+        assert libreoffice.convert_many([good], output_dir)[0].ok
+    assert not caplog.records
+
+    with caplog.at_level(logging.ERROR, logger="python_odt_template"):
+        results = libreoffice.convert_many([good, broken], output_dir)
+    assert results[0].ok
+    assert not results[1].ok
+    assert "javaldx" in str(results[1].error)
+    assert "javaldx" in caplog.text
+
+
+@pytest.mark.parametrize("exec_bin", ["missing", "not-executable"])
+def test_convert_many_reports_unusable_soffice(tmp_path, caplog, exec_bin):
+    input_files = [tmp_path / "first.odt", tmp_path / "second.odt"]
+    for input_file in input_files:
+        input_file.write_bytes(b"odt")
+    (tmp_path / "not-executable").write_text("")
+    libreoffice = LibreOffice(batch_size=1)
+    libreoffice.exec_bin = str(tmp_path / exec_bin)
+
+    with caplog.at_level(logging.ERROR, logger="python_odt_template"):
+        results = libreoffice.convert_many(input_files, tmp_path)
+
+    assert [result.input_file for result in results] == input_files
+    assert not any(result.ok for result in results)
+    assert all(exec_bin in str(result.error) for result in results)
+    assert exec_bin in caplog.text
+
+
+FAKE_UNOSERVER = """\
+import argparse
+import os
+import time
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCServer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--interface")
+parser.add_argument("--port", type=int)
+args, _ = parser.parse_known_args()
+
+
+def convert(inpath, indata, outpath, convert_to, filtername, filter_options, update_index):
+    if indata.data == b"crash":
+        os._exit(1)
+    time.sleep(0.2)
+    return xmlrpc.client.Binary(f"{os.getpid()}:{convert_to}:".encode() + indata.data)
+
+
+server = SimpleXMLRPCServer((args.interface, args.port), logRequests=False, allow_none=True)
+server.register_function(convert)
+server.serve_forever()
+"""
+
+
+@pytest.fixture
+def unoserver():
+    """A unoserver stand-in on an ephemeral port, serving its own convert function."""
+    server = SimpleXMLRPCServer(("127.0.0.1", 0), logRequests=False, allow_none=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def free_ports(count: int) -> int:
+    """A port starting *count* consecutive free ports."""
+    while True:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        try:
+            with contextlib.ExitStack() as stack:
+                for offset in range(count):
+                    stack.enter_context(socket.socket()).bind(("127.0.0.1", port + offset))
+        except OSError:
+            continue
+        return port
+
+
+def fake_pool(tmp_path, **kwargs) -> LibreOfficePool:
+    script = tmp_path / "unoserver.py"
+    script.write_text(FAKE_UNOSERVER)
+    size = kwargs.get("size", 2)
+    return LibreOfficePool(port=free_ports(2 * size), server_command=[sys.executable, str(script)], **kwargs)
+
+
+def test_uno_client_converts_bytes(unoserver):
+    calls = []
+
+    def convert(inpath, indata, outpath, convert_to, filtername, filter_options, update_index):
+        calls.append((inpath, outpath, convert_to, filtername))
+        return xmlrpc.client.Binary(b"converted " + indata.data)
+
+    unoserver.register_function(convert)
+    converter = UnoClientConverter(port=unoserver.server_address[1], timeout=5)
+
+    assert converter.convert_bytes(b"document", "docx", "MS Word 2007 XML") == b"converted document"
+    assert converter.convert_bytes(b"again") == b"converted again"
+    assert calls == [(None, None, "docx", "MS Word 2007 XML"), (None, None, "pdf", None)]
+
+
+def test_uno_client_maps_errors(unoserver, tmp_path):
+    def convert(*args):
+        raise RuntimeError("filter not found")
+
+    unoserver.register_function(convert)
+    converter = UnoClientConverter(port=unoserver.server_address[1], timeout=5)
+    with pytest.raises(LibreOfficeError, match="filter not found"):
+        converter.convert_bytes(b"document")
+
+    # Without a server the connection error is mapped too
+    with pytest.raises(LibreOfficeError):
+        UnoClientConverter(port=free_ports(1), timeout=5).convert_bytes(b"document")
+
+    input_file = tmp_path / "document.odt"
+    input_file.write_bytes(b"document")
+    converter.convert(input_file, tmp_path)
+    assert not (tmp_path / "document.pdf").exists()
+    with pytest.raises(LibreOfficeError):
+        UnoClientConverter(port=unoserver.server_address[1], raise_on_error=True).convert(input_file, tmp_path)
+
+
+def test_pool_dispatches_to_idle_workers(tmp_path):
+    with fake_pool(tmp_path, size=2) as pool, ThreadPoolExecutor(2) as executor:
+        outputs = list(executor.map(pool.convert_bytes, [b"first", b"second"]))
+        pids = {output.split(b":")[0] for output in outputs}
+        assert [output.split(b":", 1)[1] for output in outputs] == [b"pdf:first", b"pdf:second"]
+        assert len(pids) == 2
+
+        # Idle workers are reused rather than restarted
+        assert {pool.convert_bytes(b"third").split(b":")[0] for _ in range(2)} <= pids
+
+
+def test_pool_restarts_crashed_and_recycled_workers(tmp_path):
+    with fake_pool(tmp_path, size=1, max_jobs=2) as pool:
+        pid = pool.convert_bytes(b"document").split(b":")[0]
+        with pytest.raises(LibreOfficeError):
+            pool.convert_bytes(b"crash")
+        restarted = pool.convert_bytes(b"document").split(b":")[0]
+        assert restarted != pid
+
+        assert pool.convert_bytes(b"document").split(b":")[0] == restarted
+        # max_jobs conversions later the worker is replaced
+        assert pool.convert_bytes(b"document").split(b":")[0] != restarted
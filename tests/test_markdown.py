@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import pytest
+from python_odt_template.filters import _stable_id
+from python_odt_template.filters import markdown_to_odt
+from python_odt_template.filters import odt_markdown
+from python_odt_template.xmlbackend import parse_xml
+
+NESTED_LIST = "- one\n- two\n    - nested *a*\n    - nested b\n- three\n"
+
+CORPUS = [
+    (
+        NESTED_LIST,
+        (
+            '<text:list xml:id="{list0}">\n'
+            "<text:list-item><text:p>one</text:p></text:list-item>\n"
+            '<text:list-item><text:p>two\n<text:list xml:id="{list1}">\n'
+            '<text:list-item><text:p>nested <text:span text:style-name="markdown_italic">a</text:span></text:p>'
+            "</text:list-item>\n"
+            "<text:list-item><text:p>nested b</text:p></text:list-item>\n"
+            "</text:list></text:p></text:list-item>\n"
+            "<text:list-item><text:p>three</text:p></text:list-item>\n"
+            "</text:list>\n"
+        ),
+    ),
+    (
+        "1. first\n\n2. second\n",
+        (
+            '<text:list xml:id="{list0}">\n'
+            '<text:list-item><text:p text:style-name="Standard">first</text:p></text:list-item>\n'
+            '<text:list-item><text:p text:style-name="Standard">second</text:p></text:list-item>\n'
+            "</text:list>\n"
+        ),
+    ),
+    (
+        "Code:\n\n    line 1\n\n    line <2> & 3\n\nafter",
+        (
+            '<text:p text:style-name="Standard">Code:</text:p><text:p text:style-name="Standard"/>'
+            '<text:p text:style-name="Preformatted_20_Text"><text:span text:style-name="Preformatted_20_Text">'
+            "<text:span>line 1<text:line-break/><text:line-break/>line &lt;2&gt; &amp; 3<text:line-break/></text:span>"
+            '</text:span></text:p><text:p text:style-name="Standard"/><text:p text:style-name="Standard">after</text:p>\n'
+        ),
+    ),
+    (
+        "Inline `a < b` code",
+        (
+            '<text:p text:style-name="Standard">Inline <text:span text:style-name="Preformatted_20_Text">'
+            "<text:span>a &lt; b</text:span></text:span> code</text:p>\n"
+        ),
+    ),
+    (
+        'A [link](https://example.com/?a=1&b=2 "Title") and <https://example.org>',
+        (
+            '<text:p text:style-name="Standard">A '
+            '<text:a xlink:type="simple" xlink:href="https://example.com/?a=1&amp;b=2">link</text:a> and '
+            '<text:a xlink:type="simple" xlink:href="https://example.org">https://example.org</text:a></text:p>\n'
+        ),
+    ),
+    (
+        'Tom &amp; Jerry &copy; 5 < 6 & "q"',
+        '<text:p text:style-name="Standard">Tom &amp; Jerry © 5 &lt; 6 &amp; "q"</text:p>\n',
+    ),
+    (
+        "**bold** and _it_  \nnext line",
+        (
+            '<text:p text:style-name="Standard"><text:span text:style-name="markdown_bold">bold</text:span> and '
+            '<text:span text:style-name="markdown_italic">it</text:span><text:line-break/>\nnext line</text:p>\n'
+        ),
+    ),
+    (
+        "- a\n\n1. b\n",
+        (
+            '<text:list xml:id="{list0}">\n<text:list-item><text:p>a</text:p></text:list-item>\n</text:list>'
+            '<text:p text:style-name="Standard"/>'
+            '<text:list xml:id="{list1}">\n<text:list-item><text:p>b</text:p></text:list-item>\n</text:list>\n'
+        ),
+    ),
+]
+
+
+@pytest.mark.parametrize(("source", "expected"), CORPUS)
+def test_markdown_to_odt(source, expected):
+    ids = {f"list{index}": _stable_id("list", source, index) for index in range(2)}
+    odt = markdown_to_odt(source)
+    assert odt == expected.format(**ids)
+    assert odt_markdown(source) == odt
+
+    # The output is well-formed once its namespaces are declared
+    parse_xml(
+        '<root xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+        f' xmlns:xlink="http://www.w3.org/1999/xlink">{odt}</root>'
+    )
+
+
+def test_list_ids_are_stable_and_depend_on_the_source():
+    list_id = _stable_id("list", NESTED_LIST, 0)
+    assert list_id.startswith("list")
+    assert len(list_id) == len("list") + 18
+    assert _stable_id("list", NESTED_LIST, 0) == list_id
+    assert _stable_id("list", NESTED_LIST, 1) != list_id
+    assert _stable_id("list", NESTED_LIST + "- four\n", 0) != list_id
+
+    assert markdown_to_odt(NESTED_LIST) == markdown_to_odt(NESTED_LIST)
+    assert list_id not in markdown_to_odt(NESTED_LIST + "- four\n")
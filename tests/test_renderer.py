@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import io
+import zipfile
+
+import pytest
+from jinja2 import Environment
+from jinja2 import StrictUndefined
+from jinja2 import UndefinedError
+from python_odt_template import InvalidXMLError
+from python_odt_template.jinja import get_odt_renderer
+from python_odt_template.renderer import iter_render_images_in_text
+from python_odt_template.renderer import render_images_in_text
+from python_odt_template.template import ODTTemplate
+
+
+def read_member(document: bytes, name: str = "content.xml") -> str:
+    with zipfile.ZipFile(io.BytesIO(document)) as archive:
+        return archive.read(name).decode()
+
+
+def test_compiled_template_holds_no_parsed_parts(field_template):
+    renderer = get_odt_renderer(".")
+    for source in (field_template, ODTTemplate(field_template)):
+        compiled = renderer.compile(source)
+        assert compiled.template.documents == {}
+        assert "rendered" in read_member(compiled.render({"value": "rendered"}))
+        # Rendering does not parse them again
+        assert compiled.template.documents == {}
+
+
+LOOP_IMAGE_MARKDOWN = (
+    "<text:p><text:text-input>{% for row in rows %}</text:text-input></text:p>"
+    "<text:p>Row <text:text-input>{{ row.name }}</text:text-input></text:p>"
+    "<text:p><text:text-input>{% endfor %}</text:text-input></text:p>"
+    '<text:p><draw:frame draw:name="{{ logo|image }}" svg:width="1in" svg:height="1in">'
+    '<draw:image xlink:href="Pictures/placeholder.png" xlink:type="simple"/></draw:frame></text:p>'
+    "<text:p><text:text-input>{{ notes|odt_markdown|safe }}</text:text-input></text:p>"
+)
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(64))
+
+NOTES = """\
+Some *emphasis* and a [link](https://example.com/?a=1&b=2).
+
+- first
+- second with `code`
+
+```
+preformatted
+```
+"""
+
+
+def context(rows: int = 200) -> dict:
+    return {"rows": [{"name": f"row {index}"} for index in range(rows)], "logo": PNG, "notes": NOTES}
+
+
+def members(document: bytes) -> dict[str, bytes]:
+    with zipfile.ZipFile(io.BytesIO(document)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist()[0] == "mimetype"
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def renderer_in_mode(mode: str, **kwargs):
+    renderer = get_odt_renderer(".", **kwargs)
+    if mode != "parse":
+        setattr(renderer, f"{mode}_xml", True)
+    return renderer
+
+
+def test_stream_mode_renders_the_same_members_as_parse_mode(odt_factory):
+    source = odt_factory(LOOP_IMAGE_MARKDOWN)
+    parsed = members(renderer_in_mode("parse").compile(source).render(context()))
+    streamed = members(renderer_in_mode("stream").compile(source).render(context()))
+
+    # The streamed content is written first, with its sizes after its data
+    assert streamed == parsed
+    content = parsed["content.xml"].decode()
+    assert "row 199" in content
+    assert content.count("Pictures/") == 1
+    assert any(name.startswith("Pictures/") for name in parsed)
+    assert "<text:list" in content
+
+
+def test_failing_stream_leaves_no_partial_file(odt_factory, tmp_path):
+    compiled = renderer_in_mode("stream", env=Environment(undefined=StrictUndefined)).compile(
+        odt_factory(LOOP_IMAGE_MARKDOWN)
+    )
+    failing = context(5000)
+    del failing["rows"][-1]["name"]
+    target = tmp_path / "document.odt"
+
+    with pytest.raises(UndefinedError):
+        compiled.write(failing, target)
+    assert not target.exists()
+
+    compiled.write(context(), target)
+    assert "row 199" in read_member(target.read_bytes())
+
+
+def test_splice_mode_renders_the_same_members_as_parse_mode(odt_factory):
+    source = odt_factory(LOOP_IMAGE_MARKDOWN)
+    parsed = renderer_in_mode("parse").compile(source).render(context())
+    spliced = renderer_in_mode("splice").compile(source).render(context())
+
+    assert members(spliced) == members(parsed)
+
+
+FRAMES = (
+    '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+    ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+    ' xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0"'
+    ' xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0"'
+    ' xmlns:xlink="http://www.w3.org/1999/xlink"><office:body><office:text><text:p>'
+    "<draw:frame svg:width='1in'\n    draw:name='{path}'\n    svg:height=\"1in\">"
+    '<draw:image xlink:type="simple"\n xlink:href="Pictures/placeholder.png"/></draw:frame>'
+    '<draw:frame\tdraw:name = "{path}" >\n<draw:image xlink:href="Pictures/placeholder.png" /></draw:frame>'
+    '<draw:frame draw:name="missing.png"><draw:image xlink:href="Pictures/kept.png"/></draw:frame>'
+    "</text:p></office:text></office:body></office:document-content>"
+)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 7, 64 * 1024])
+def test_frames_are_rewritten_whatever_their_attribute_layout(tmp_path, buffer_size):
+    image_path = tmp_path / "logo.png"
+    image_path.write_bytes(PNG)
+    source = FRAMES.replace("{path}", str(image_path))
+    written = []
+
+    def image_writer(image, name):
+        written.append(name)
+        return f"Pictures/{name}.png"
+
+    rendered = render_images_in_text(source, image_writer)
+    assert "".join(iter_render_images_in_text(source, image_writer, buffer_size=buffer_size)) == rendered
+
+    assert written == ["logo"] * 4
+    assert '<draw:frame\tdraw:name = "logo" >' in rendered
+    assert rendered.count('xlink:href="Pictures/logo.png"') == 2
+    assert 'svg:width=\'1in\'\n    draw:name="logo"\n    svg:height="1in">' in rendered
+    assert '<draw:image xlink:type="simple"\n xlink:href="Pictures/logo.png"/>' in rendered
+    assert 'xlink:href="Pictures/kept.png"' in rendered
+    assert 'draw:name="missing.png"' in rendered
+
+
+def test_validate_xml_rejects_malformed_spliced_output(odt_factory):
+    source = odt_factory("<text:p><text:text-input>{{ value|safe }}</text:text-input></text:p>")
+    assert "<text:span>" in read_member(renderer_in_mode("splice").compile(source).render({"value": "<text:span>"}))
+
+    renderer = renderer_in_mode("splice")
+    renderer.validate_xml = True
+    compiled = renderer.compile(source)
+    with pytest.raises(InvalidXMLError):
+        compiled.render({"value": "<text:span>"})
+    assert "closed" in read_member(compiled.render({"value": "<text:span>closed</text:span>"}))
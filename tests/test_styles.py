@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import pytest
+from python_odt_template.template import ODTTemplate
+from python_odt_template.xmlbackend import qname
+
+AUTOMATIC_STYLES = (
+    '<style:style style:name="T1" style:family="text"><style:text-properties fo:font-weight="bold"/></style:style>'
+    '<style:style style:name="T1" style:family="text"><style:text-properties fo:font-style="italic"/></style:style>'
+    '<style:style style:name="P1" style:family="paragraph"/>'
+    '<style:style style:name="P1" style:family="text"/>'
+)
+STYLES = (
+    '<style:style style:name="Standard" style:family="paragraph"/>'
+    '<style:style style:name="Preformatted_20_Text" style:family="paragraph">'
+    '<style:text-properties style:font-name="Liberation Mono" fo:font-family="&apos;Liberation Mono&apos;"'
+    ' style:font-family-generic="modern" style:font-pitch="fixed"/></style:style>'
+)
+
+
+@pytest.fixture
+def template(odt_factory) -> ODTTemplate:
+    return ODTTemplate(odt_factory("<text:p/>", AUTOMATIC_STYLES, STYLES))
+
+
+def properties(style) -> dict:
+    return dict(next(style.iter(qname("style:text-properties"))).attrib)
+
+
+def test_first_style_with_a_name_wins(template):
+    style = template.style_index().get("T1")
+    assert properties(style) == {qname("fo:font-weight"): "bold"}
+    assert template.get_style_node("T1") is style
+
+
+def test_styles_are_looked_up_by_family(template):
+    index = template.style_index()
+    paragraph = index.get("P1", "paragraph")
+    text = index.get("P1", "text")
+    assert paragraph.get(qname("style:family")) == "paragraph"
+    assert text.get(qname("style:family")) == "text"
+    assert index.get("P1", "table") is None
+    # In a container, a style shadowed by another family is still found
+    container = template.get_automatic_styles()
+    assert index.get("P1", "text", container) is text
+    assert template.get_style_node("P1", family="text") is text
+
+
+def test_reindex_styles_sees_direct_edits(template):
+    container = template.get_automatic_styles()
+    assert template.get_style_node("T2") is None
+
+    container.append(template.content.create_element("style:style", {"style:name": "T2", "style:family": "text"}))
+    assert template.style_index().get("T2") is None
+    template.reindex_styles()
+    assert template.get_style_node("T2") is not None
+
+
+def test_find_style_looks_in_content_and_styles(template):
+    assert template.find_style("T1") is template.style_index().get("T1")
+    assert template.find_style("Standard") is template.style_index("styles.xml").get("Standard")
+    assert template.find_style("Standard", "text") is None
+    assert template.find_style("Missing") is None
+
+
+def test_markdown_styles_are_inserted_once(template):
+    template.insert_markdown_style(include_code=True)
+    count = len(template.get_automatic_styles())
+    code = template.get_style_node("markdown_code")
+    assert properties(code)[qname("style:font-name")] == "Liberation Mono"
+
+    template.insert_markdown_style(include_code=True)
+    assert len(template.get_automatic_styles()) == count
+    names = [style.get(qname("style:name")) for style in template.get_automatic_styles()]
+    assert names.count("markdown_code") == 1
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import copy
+import io
+import zipfile
+
+from python_odt_template import template
+from python_odt_template.jinja import get_odt_renderer
+from python_odt_template.template import Image
+from python_odt_template.template import ODTTemplate
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(64))
+
+
+def render(source: bytes) -> bytes:
+    compiled = get_odt_renderer(".").compile(source)
+    return compiled.render({"value": "rendered"})
+
+
+def check_archive(document: bytes, source: bytes) -> None:
+    with zipfile.ZipFile(io.BytesIO(document)) as archive, zipfile.ZipFile(io.BytesIO(source)) as original:
+        assert archive.testzip() is None
+        assert archive.namelist()[0] == "mimetype"
+        assert "rendered" in archive.read("content.xml").decode()
+        thumbnail = "Thumbnails/thumbnail.png"
+        assert archive.read(thumbnail) == original.read(thumbnail)
+        assert archive.getinfo(thumbnail).compress_type == original.getinfo(thumbnail).compress_type
+
+
+def test_unchanged_members_are_copied_intact(field_template):
+    document = render(field_template)
+    check_archive(document, field_template)
+    # Rendering again gives the same bytes
+    assert render(field_template) == document
+
+
+def test_unchanged_members_fall_back_to_recompressing(field_template, monkeypatch):
+    expected = render(field_template)
+
+    def read_raw_member(source, info):
+        # As if zipfile no longer had the internals used to read the member
+        raise AttributeError("structFileHeader")
+
+    monkeypatch.setattr(template, "_read_raw_member", read_raw_member)
+    compiled = get_odt_renderer(".").compile(field_template)
+    document = compiled.render({"value": "rendered"})
+    check_archive(document, field_template)
+    assert document == expected
+    # The template infos are left untouched, the next render works as well
+    assert compiled.render({"value": "rendered"}) == expected
+
+
+def test_raw_copy_refuses_unexpected_layout(field_template):
+    with zipfile.ZipFile(io.BytesIO(field_template)) as archive:
+        info = copy.copy(archive.getinfo("Thumbnails/thumbnail.png"))
+    info.header_offset += 1
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as zipdoc:
+        assert not template._copy_raw_member(zipdoc, info, field_template)
+        assert zipdoc.filelist == []
+        assert output.tell() == 0
+
+
+class NonSeekableStream(io.RawIOBase):
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.data += b
+        return len(b)
+
+
+def members(document: bytes) -> dict[str, bytes]:
+    with zipfile.ZipFile(io.BytesIO(document)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist()[0] == "mimetype"
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_template_is_read_from_bytes_path_or_file_object(field_template, tmp_path):
+    path = tmp_path / "template.odt"
+    path.write_bytes(field_template)
+    expected = ODTTemplate(field_template).pack_bytes()
+
+    for source in (bytearray(field_template), path, str(path), io.BytesIO(field_template)):
+        odt_template = ODTTemplate(source)
+        assert odt_template.source == field_template
+        assert odt_template.pack_bytes() == expected
+
+
+def test_pack_to_stream_and_iter_pack(field_template):
+    odt_template = ODTTemplate(field_template)
+    odt_template.write_file("content.xml", odt_template.read_file("content.xml").replace("{{ value }}", "rendered"))
+    odt_template.add_image(Image.from_bytes(PNG), "logo")
+    expected = members(odt_template.pack_bytes())
+    assert "rendered" in expected["content.xml"].decode()
+    assert expected["Thumbnails/thumbnail.png"] == members(field_template)["Thumbnails/thumbnail.png"]
+
+    # Sizes of the members written to a non seekable stream follow their data
+    stream = NonSeekableStream()
+    odt_template.pack(stream)
+    assert members(bytes(stream.data)) == expected
+
+    chunks = list(odt_template.iter_pack())
+    assert len(chunks) > 1
+    assert b"".join(chunks) == bytes(stream.data)
+
+
+def test_member_recompressed_when_its_compression_must_change(field_template):
+    source = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(field_template)) as original, zipfile.ZipFile(source, "w") as archive:
+        for info in original.infolist():
+            archive.writestr(info, original.read(info), zipfile.ZIP_DEFLATED)
+
+    document = ODTTemplate(source.getvalue()).pack_bytes()
+    with zipfile.ZipFile(io.BytesIO(document)) as archive:
+        # The mimetype is always stored, the other members keep their compression
+        assert archive.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("content.xml").compress_type == zipfile.ZIP_DEFLATED
+    assert members(document) == members(field_template)
+
+
+def test_packs_of_the_same_render_are_identical(field_template, monkeypatch):
+    source = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(field_template)) as original, zipfile.ZipFile(source, "w") as archive:
+        for info in original.infolist():
+            info.date_time = (2021, 6, 15, 8, 30, 0)
+            archive.writestr(info, original.read(info))
+    compiled = get_odt_renderer(".").compile(source.getvalue())
+
+    def render_with_logo() -> bytes:
+        odt_template = ODTTemplate(compiled.render({"value": "rendered"}))
+        odt_template.add_image(Image.from_bytes(PNG), "logo")
+        return odt_template.pack_bytes()
+
+    document = render_with_logo()
+    # A later render, as if made on another day
+    monkeypatch.setattr("time.time", lambda: 2e9)
+    assert render_with_logo() == document
+
+    with zipfile.ZipFile(io.BytesIO(document)) as archive:
+        for info in archive.infolist():
+            if info.filename.startswith("Pictures/"):
+                assert info.date_time == template._FIXED_DATE_TIME
+            else:
+                assert info.date_time == (2021, 6, 15, 8, 30, 0)
+        assert any(name.startswith("Pictures/") for name in archive.namelist())
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import contextlib
+
+import pytest
+from python_odt_template import tracing
+from python_odt_template.jinja import get_odt_renderer
+
+
+@pytest.fixture
+def recorded():
+    """The (name, seconds, attributes) of the spans ended while a hook is registered."""
+    spans = []
+
+    def hook(name, seconds, attributes):
+        spans.append((name, seconds, attributes))
+
+    tracing.add_hook(hook)
+    yield spans
+    tracing.remove_hook(hook)
+
+
+class FakeOtelSpan:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class FakeTracer:
+    def __init__(self):
+        self.spans = []
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        otel_span = FakeOtelSpan(name, attributes)
+        self.spans.append(otel_span)
+        yield otel_span
+
+
+def test_hooks_get_nested_spans_as_they_end(recorded):
+    with tracing.span("outer", {"size": 1}) as outer:
+        with tracing.span("inner") as inner:
+            inner.set_attribute("items", 2)
+        outer.set_attribute("bytes", 3)
+
+    assert [(name, attributes) for name, _, attributes in recorded] == [
+        ("inner", {"items": 2}),
+        ("outer", {"size": 1, "bytes": 3}),
+    ]
+    assert all(seconds >= 0 for _, seconds, _ in recorded)
+    assert recorded[1][1] >= recorded[0][1]
+
+
+def test_failing_span_reports_its_error(recorded):
+    with pytest.raises(KeyError), tracing.span("failing"):
+        raise KeyError("missing")
+    assert recorded[0][0] == "failing"
+    assert recorded[0][2] == {"error": "KeyError"}
+
+
+def test_removed_hook_is_no_longer_called():
+    names = []
+
+    def hook(name, seconds, attributes):
+        names.append(name)
+
+    tracing.add_hook(hook)
+    with tracing.span("kept"):
+        pass
+    tracing.remove_hook(hook)
+    with tracing.span("dropped") as current:
+        assert current is tracing._NOOP_SPAN
+    assert names == ["kept"]
+
+
+def test_tracer_gets_spans_until_unset():
+    tracer = FakeTracer()
+    tracing.set_tracer(tracer)
+    try:
+        with tracing.span("traced", {"size": 1}) as current:
+            current.set_attribute("bytes", 2)
+    finally:
+        tracing.set_tracer(None)
+
+    assert [(otel_span.name, otel_span.attributes) for otel_span in tracer.spans] == [
+        ("traced", {"size": 1, "bytes": 2})
+    ]
+    with tracing.span("untraced") as current:
+        assert current is tracing._NOOP_SPAN
+    assert len(tracer.spans) == 1
+
+
+def test_render_stages_are_traced(recorded, field_template):
+    get_odt_renderer(".").compile(field_template).render({"value": "rendered"})
+
+    names = [name for name, _, _ in recorded]
+    assert {"odt.unpack", "odt.render", "odt.document", "odt.pack"} <= set(names)
+    # The document span holds the render of its parts
+    assert names.index("odt.render") < names.index("odt.document")
+    render_attributes = next(attributes for name, _, attributes in recorded if name == "odt.render")
+    assert render_attributes["odt.xml.bytes"] > 0
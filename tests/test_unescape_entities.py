@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import random
+import re
+from urllib.parse import unquote
+
+import pytest
+from python_odt_template.jinja import get_odt_renderer
+
+# Tricky tag contents: entities at tag boundaries, '%' and '}' around them,
+# unclosed and nested tags, double escaping and upper case entities.
+CORPUS = [
+    "",
+    "no tags &amp; &lt;here&gt;",
+    "{{ a &gt; b }}",
+    "{% if a &lt; b and c &gt; d %}",
+    "{{ &quot;x&quot; ~ &apos;y&apos; }}",
+    "{{ a &amp;amp; b }}",
+    "{{ a &amp;amp;amp;gt; b }}",
+    "{{ a &AMP; b &GT; c }}",
+    "{{ a &amp;quot; b }}",
+    "{{ '50%' &gt; a }}",
+    "{{ a &gt; '50%' }}",
+    "{{ a } &gt; b }}",
+    "{{ a &gt; b } c }}",
+    "{{ a { &gt; b }}",
+    "{{ a &gt; { b }}",
+    "{{ a &gt; b",
+    "a &gt; b }}",
+    "{{ a }} &gt; {{ b }}",
+    "{{ a {{ b &gt; c }}",
+    "{% a %}&gt;{% b %}",
+    "{{%&gt;%}}",
+    "{%}&gt;{%}",
+    "{{ a &gt; b %}}",
+    "{% for x in y &amp;&amp; z %}{{ x &lt;= 1 }}{% endfor %}",
+    '<text:a xlink:href="secretary:%7B%7B%20url%20%7D%7D">{{ a &gt; 1 }}</text:a>',
+    '<text:a xlink:href="SECRETARY:secretary:%7B%7B%20x%20%7D%7D"/>',
+    '<text:a xlink:href="ſecretary:%7B%7B%20x%20%7D%7D"/>',
+    "<text:p>{{ a\n&gt;\nb }}</text:p>",
+    "{{ a &apoſ; b &GT; }}",
+]
+
+TOKENS = [
+    'xlink:href="secretary:%7B%7B"',
+    "{{",
+    "}}",
+    "{%",
+    "%}",
+    "{",
+    "}",
+    "%",
+    "&gt;",
+    "&lt;",
+    "&amp;",
+    "&AMP;",
+    "&quot;",
+    "&apos;",
+    "&",
+    "a",
+    " ",
+    "\n",
+]
+
+
+def legacy_unescape_entities(renderer, xml_text: str) -> str:
+    for regexp, replacement in renderer.escape_map.items():
+        while True:
+            xml_text, substitutions = regexp.subn(replacement, xml_text)
+            if not substitutions:
+                break
+
+    robj = re.compile(r"(?is)(xlink:href=\")secretary:(.*?)(\")")
+
+    def replacement(match):
+        url = renderer.variable_pattern.sub(r"\1 SafeValue(\2) \3", unquote(match.group(2)))
+        return match.group(1) + url + match.group(3)
+
+    while True:
+        xml_text, rep = robj.subn(replacement, xml_text)
+        if not rep:
+            break
+
+    return xml_text
+
+
+@pytest.fixture(scope="module")
+def renderer():
+    return get_odt_renderer(media_path=".")
+
+
+@pytest.mark.parametrize("case", CORPUS)
+def test_unescape_entities_matches_legacy_on_corpus(renderer, case):
+    assert renderer._unescape_entities(case) == legacy_unescape_entities(renderer, case)
+
+
+def test_unescape_entities_matches_legacy_on_random_documents(renderer):
+    generator = random.Random(0)
+    for _ in range(2000):
+        case = "".join(generator.choices(TOKENS, k=generator.randint(1, 30)))
+        assert renderer._unescape_entities(case) == legacy_unescape_entities(renderer, case), case
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from xml.parsers.expat import ExpatError
+
+import pytest
+from defusedxml import DTDForbidden
+from python_odt_template import xmlbackend
+from python_odt_template.renderer import InvalidXMLError
+from python_odt_template.renderer import parse_rendered_xml
+
+
+@pytest.fixture(params=sorted(xmlbackend.BACKENDS))
+def backend(request, monkeypatch):
+    """Each available backend, as the default one."""
+    monkeypatch.setattr(xmlbackend, "_default_backend", xmlbackend.get_backend(request.param))
+    return request.param
+
+
+def test_invalid_xml_message_points_at_the_error(backend):
+    with pytest.raises(InvalidXMLError) as excinfo:
+        parse_rendered_xml("<a>\n<b></a>")
+
+    error = excinfo.value
+    assert isinstance(error, ExpatError)
+    assert error.lineno == 2
+    # expat columns start at 0, lxml reports the column after the tag
+    column = {"etree": 5, "lxml": 7}[backend]
+    assert error.offset == column
+    assert str(error) == f"Invalid XML near line 2, column {column}\n<b></a>\n{'-' * column}^"
+    assert isinstance(error.__cause__, xmlbackend.get_backend(backend).parse_errors)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        '<!DOCTYPE a [<!ENTITY x "y">]><a>&x;</a>',
+        '<!DOCTYPE a SYSTEM "http://example.com/a.dtd"><a/>',
+        '<!DOCTYPE a [<!ENTITY x SYSTEM "file:///etc/passwd">]><a>&x;</a>',
+    ],
+)
+def test_dtds_and_entities_are_refused(backend, source):
+    # lxml fails to load an external DTD before the document is checked
+    with pytest.raises((DTDForbidden, InvalidXMLError)):
+        parse_rendered_xml(source)
+
+
+EDITED = (
+    '<r xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">head'
+    "<text:p>p1<text:span>s1</text:span>t1<text:span>s2</text:span>t2</text:p>p1 tail"
+    "<text:p>p2</text:p>p2 tail"
+    "<text:p>p3<text:span>s3</text:span></text:p>"
+    "</r>"
+)
+
+
+def edit(editor, document):
+    """The same edits, made on *editor*: the document itself or its TreeEdits."""
+    p1, p2, p3 = document.root
+    s1, s2 = p1
+    (s3,) = p3
+    # Several edits around the same element, in an order that matters
+    editor.insert_text_before(p1, "a")
+    editor.insert_before(p1, document.create_element("text:h", text="new"))
+    editor.insert_text_before(p1, "b")
+    editor.insert_text_after(p1, "c")
+    editor.insert_text_after(p1, "d")
+    # Nested edits, in an edited element and in a removed one
+    editor.insert_text_before(s1, "e")
+    editor.remove(s2)
+    editor.insert_text_after(s1, "f")
+    editor.insert_text_before(s3, "g")
+    # Edits around removed elements
+    editor.insert_text_before(p2, "h")
+    editor.remove(p2)
+    editor.insert_text_after(p3, "i")
+    editor.remove(p3)
+
+
+def test_tree_edits_are_the_same_as_editing_in_order(backend):
+    expected = xmlbackend.parse_xml(EDITED)
+    edit(expected, expected)
+
+    document = xmlbackend.parse_xml(EDITED)
+    edits = xmlbackend.TreeEdits(document)
+    edit(edits, document)
+    edits.apply()
+
+    assert document.toxml() == expected.toxml()
+    assert document.toxml().endswith(
+        ">heada<text:h>new</text:h>b<text:p>p1e<text:span>s1</text:span>ft1t2</text:p>dcp1 tailhp2 taili</r>"
+    )
+    assert edits.parents == {}
+    # The parents follow the edits
+    new = document.root[0]
+    assert document.parent(new) is document.root
+    assert document.parent(document.root[1][0]) is document.root[1]
+
+    with pytest.raises(ValueError):
+        edits.remove(document.root)
+
+
+def test_replace_by_an_element_of_another_document(backend):
+    document = xmlbackend.parse_xml(
+        '<r xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"><text:p>old</text:p>tail</r>'
+    )
+    other = xmlbackend.parse_xml(
+        '<o xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+        ' xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0">'
+        '<text:p>new <draw:frame draw:name="f"/></text:p></o>'
+    )
+    new = other.root[0]
+    document.replace(document.root[0], new)
+
+    replaced = document.root[0]
+    assert document.parent(replaced) is document.root
+    assert replaced.tail == "tail"
+    assert replaced[0].get(xmlbackend.qname("draw:name")) == "f"
+    # The result declares the namespaces it uses
+    reparsed = xmlbackend.parse_xml(document.toxml())
+    assert reparsed.find("draw:frame") is not None
+    assert reparsed.find("text:p").text == "new "
+    if backend == "lxml":
+        # lxml gets a copy, the other document is left as it was
+        assert replaced is not new
+        assert other.root[0] is new